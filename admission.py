@@ -0,0 +1,81 @@
+import math
+import time
+import queue
+import threading
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets: rate tokens per second, up to burst saved up"""
+
+    def __init__(self, rate=5.0, burst=20, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys  # Full buckets are forgotten past this many keys
+        self.buckets = {}  # {key: [tokens, last refill time]}
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        """0 if the call may proceed, otherwise seconds until the next token"""
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.prune(now)
+                bucket = self.buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / self.rate
+
+    def prune(self, now):
+        # Caller must hold self.lock; a bucket that has refilled completely carries no state
+        full_after = self.burst / self.rate
+        for key in [key for key, (_, last) in self.buckets.items() if now - last >= full_after]:
+            del self.buckets[key]
+
+
+class WorkerPool:
+    """Fixed number of threads serving connections handed over through a bounded queue"""
+
+    def __init__(self, handler, workers=256, queue_size=1024):
+        self.handler = handler
+        self.workers = workers
+        self.queue = queue.Queue(queue_size)
+        self.busy = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        for _ in range(self.workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def saturated(self):
+        # Every worker holds a connection, nothing queued now would be served before one closes
+        return self.busy >= self.workers
+
+    def submit(self, *args):
+        """Queue a connection, False when the queue is full and the caller must shed it"""
+        try:
+            self.queue.put_nowait(args)
+            return True
+        except queue.Full:
+            return False
+
+    def work(self):
+        while True:
+            args = self.queue.get()
+            with self.lock:
+                self.busy += 1
+            try:
+                self.handler(*args)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+
+
+def retry_after(seconds):
+    # Retry-After takes whole seconds
+    return max(1, math.ceil(seconds))
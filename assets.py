@@ -0,0 +1,77 @@
+import os
+import time
+import hashlib
+from PIL import Image, ImageTk
+
+
+class AssetCache:
+    """Decodes and resizes each image once; optionally keeps the scaled copies on disk between runs"""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir  # None keeps scaled images in memory only
+        self.images = {}  # {(path, size): PIL image or None when the file is missing}
+        self.photos = {}  # {(path, size): ImageTk.PhotoImage}
+        self.hashes = {}  # {path: source digest}
+        self.decoded = 0  # Sources opened and resized
+        self.disk_hits = 0
+        self.memory_hits = 0
+        self.load_seconds = 0.0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def source_hash(self, path):
+        digest = self.hashes.get(path)
+        if digest is None:
+            with open(path, 'rb') as f:
+                digest = self.hashes[path] = hashlib.sha1(f.read()).hexdigest()[:16]
+        return digest
+
+    def cache_path(self, path, size):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.cache_dir, '{}-{}-{}x{}.png'.format(stem, self.source_hash(path), *size))
+
+    def image(self, path, size):
+        """PIL image of path scaled to size, or None if the file does not exist"""
+        key = (path, size)
+        if key in self.images:
+            self.memory_hits += 1
+            return self.images[key]
+        start = time.perf_counter()
+        image = None
+        if os.path.exists(path):
+            scaled = self.cache_path(path, size) if self.cache_dir else None
+            if scaled and os.path.exists(scaled):
+                image = Image.open(scaled)
+                image.load()
+                self.disk_hits += 1
+            else:
+                image = Image.open(path).resize(size)
+                self.decoded += 1
+                if scaled:
+                    # Write then rename so a crashed run never leaves half a file behind
+                    image.save(scaled + '.tmp', format='PNG', compress_level=1)
+                    os.replace(scaled + '.tmp', scaled)
+        self.images[key] = image
+        self.load_seconds += time.perf_counter() - start
+        return image
+
+    def photo(self, path, size):
+        """Tk image for a label, shared between screens; None if the file does not exist"""
+        key = (path, size)
+        photo = self.photos.get(key)
+        if photo is None:
+            image = self.image(path, size)
+            if image is None:
+                return None
+            photo = self.photos[key] = ImageTk.PhotoImage(image)
+        else:
+            self.memory_hits += 1
+        return photo
+
+    def stats(self):
+        return {
+            'decoded': self.decoded,
+            'disk_hits': self.disk_hits,
+            'memory_hits': self.memory_hits,
+            'load_ms': round(self.load_seconds * 1000, 1)
+        }
@@ -0,0 +1,310 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import inspect
+from collections import deque
+
+LONG_POLL_TIMEOUT = 30  # Must outlast the server's long-poll hold
+
+
+class HttpError(Exception):
+    def __init__(self, status, body):
+        super().__init__('HTTP {}'.format(status))
+        self.status = status
+        self.body = body
+
+
+class HttpPool:
+    """Keep-alive HTTP/1.1 connections to one server, shared by every client in the process.
+
+    A request takes an idle connection or opens a new one, and gives it back once
+    the response is read, so thousands of bots need only as many sockets as they
+    have requests in flight at the same moment.
+    """
+
+    def __init__(self, host='localhost', port=55556, limit=None, max_idle=1024):
+        self.host = host
+        self.port = port
+        self.host_header = '{}:{}'.format(host, port)
+        self.limit = limit  # Connections open at once, None for no cap
+        self.max_idle = max_idle  # Idle connections kept for reuse, the rest are closed
+        self.idle = deque()  # [(reader, writer)]
+        self.open = 0
+        self.slots = asyncio.Semaphore(limit) if limit else None
+        self.connections_opened = 0
+        self.requests = 0
+        self.retries = 0
+
+    async def connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        self.open += 1
+        self.connections_opened += 1
+        return reader, writer
+
+    def discard(self, connection):
+        self.open -= 1
+        connection[1].close()
+
+    def release(self, connection):
+        if len(self.idle) < self.max_idle:
+            self.idle.append(connection)
+        else:
+            self.discard(connection)
+
+    async def request(self, method, path, headers=None, data=None, timeout=LONG_POLL_TIMEOUT):
+        """(status, headers, body) for one request; 429 and 503 are retried after their Retry-After"""
+        body = json.dumps(data).encode() if data is not None else b''
+        lines = ['{} {} HTTP/1.1'.format(method, path), 'Host: ' + self.host_header]
+        for name, value in (headers or {}).items():
+            lines.append('{}: {}'.format(name, value))
+        if data is not None:
+            lines.append('Content-Type: application/json')
+            lines.append('Content-Length: {}'.format(len(body)))
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+
+        while True:
+            status, response_headers, response_body = await self.send(request, timeout)
+            if status not in (429, 503):
+                return status, response_headers, response_body
+            # Shed or throttled, come back when the server asked us to
+            self.retries += 1
+            await asyncio.sleep(float(response_headers.get('retry-after', 1)))
+
+    async def send(self, request, timeout):
+        if self.slots is not None:
+            await self.slots.acquire()
+        try:
+            while True:
+                reused = bool(self.idle)
+                connection = self.idle.popleft() if reused else await self.connect()
+                try:
+                    connection[1].write(request)
+                    response = await asyncio.wait_for(self.read_response(connection[0]), timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    self.discard(connection)
+                    if reused:
+                        # The server closed it while it sat idle, try a fresh one
+                        continue
+                    raise
+                except BaseException:
+                    self.discard(connection)
+                    raise
+                self.requests += 1
+                status, headers, body = response
+                if headers.get('connection', '').lower() == 'close':
+                    self.discard(connection)
+                else:
+                    self.release(connection)
+                return response
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    async def read_response(self, reader):
+        head = await reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head[:-4].decode('latin-1').split('\r\n')
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        return int(status_line.split()[1]), headers, body
+
+    async def close(self):
+        while self.idle:
+            self.discard(self.idle.popleft())
+
+
+class AsyncThumbsUpClient:
+    """Async counterpart of client.ThumbsUpClient for bots; nothing happens until join_game or find_game"""
+
+    def __init__(self, pool, player_id, room_id=None):
+        self.pool = pool
+        self.player_id = player_id
+        self.room_id = room_id
+        self.headers = {'Player-ID': player_id}
+        if room_id:
+            self.headers['Room-ID'] = room_id  # Omit to play in the default room
+        self.state = None
+        self.state_version = None
+
+    async def call(self, method, path, data=None):
+        status, _, body = await self.pool.request(method, path, self.headers, data)
+        if status == 304:
+            return None
+        if status != 200:
+            raise HttpError(status, body)
+        return json.loads(body)
+
+    async def join_game(self):
+        return await self.call('GET', '/join')
+
+    async def find_game(self):
+        """Queue for matchmaking until the server seats us in a new room"""
+        while True:
+            response = await self.call('GET', '/matchmake')
+            if response['status'] == 'OK':
+                self.room_id = response['room_id']
+                self.headers['Room-ID'] = self.room_id
+                return response
+            if response['status'] != 'QUEUED':
+                raise RuntimeError(response.get('message', 'matchmaking failed'))
+
+    async def get_game_state(self, since=None):
+        path = '/game_state' if since is None else '/game_state?since={}'.format(since)
+        state = await self.call('GET', path)
+        if state is None:
+            return self.state  # Nothing changed while the server held the poll
+        self.state = state
+        self.state_version = state.get('version')
+        return state
+
+    async def wait_for_update(self):
+        # Long-poll: the server answers as soon as the state moves past our version
+        return await self.get_game_state(since=self.state_version)
+
+    async def submit_bet(self, bet, own_thumbs):
+        return await self.call('POST', '/submit_bet', {'bet': bet, 'own_thumbs': own_thumbs})
+
+    async def submit_thumbs(self, thumbs):
+        return await self.call('POST', '/submit_thumbs', {'thumbs': thumbs})
+
+
+# Strategies decide moves in place of input(): bet(state, player_id) returns (bet, own_thumbs)
+# and thumbs(state, player_id) the thumbs to raise. state is the /game_state response, either
+# method may be a coroutine, e.g. to ask a model or a remote service.
+
+
+class RandomStrategy:
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+
+    def bet(self, state, player_id):
+        own_thumbs = self.rng.randint(0, state['players'][player_id])
+        return self.rng.randint(0, sum(state['players'].values())), own_thumbs
+
+    def thumbs(self, state, player_id):
+        return self.rng.randint(0, state['players'][player_id])
+
+
+class ExpectedValueStrategy(RandomStrategy):
+    # Raise at random, bet own raise plus the expected raise of everyone else (see simulator.py)
+
+    def bet(self, state, player_id):
+        own_thumbs = self.rng.randint(0, state['players'][player_id])
+        others = sum(state['players'].values()) - state['players'][player_id]
+        return own_thumbs + round(others / 2), own_thumbs
+
+
+class OddsStrategy(RandomStrategy):
+    # Raise at random, bet what the shared odds table says is likeliest (what /hint answers)
+    odds = None
+
+    def bet(self, state, player_id):
+        if OddsStrategy.odds is None:
+            from strategy import OddsTable
+            OddsStrategy.odds = OddsTable()
+        own_thumbs = self.rng.randint(0, state['players'][player_id])
+        return self.odds.best_bet(state['players'], player_id, own_thumbs)[0], own_thumbs
+
+
+STRATEGIES = {
+    'random': RandomStrategy,
+    'expected': ExpectedValueStrategy,
+    'odds': OddsStrategy
+}
+
+
+async def decide(method, state, player_id):
+    move = method(state, player_id)
+    return await move if inspect.isawaitable(move) else move
+
+
+async def play(client, strategy, max_rounds=500, on_move=None):
+    """Play the client's match to the end with strategy, returns the winner (None if max_rounds ran out)"""
+    state = await client.get_game_state()
+    rounds = 0
+    while not state.get('winner'):
+        waiting = state['current_bet'] and client.player_id in state['waiting_for_players']
+        if state['is_my_turn'] and not state['current_bet']:
+            if rounds >= max_rounds:
+                return None
+            rounds += 1
+            bet, own_thumbs = await decide(strategy.bet, state, client.player_id)
+            result = await client.submit_bet(bet, own_thumbs)
+        elif waiting:
+            result = await client.submit_thumbs(await decide(strategy.thumbs, state, client.player_id))
+        else:
+            state = await client.wait_for_update()
+            continue
+        if on_move is not None:
+            on_move(result)
+        if result.get('game_over'):
+            return result['winner']
+        state = await client.wait_for_update()
+    return state['winner']
+
+
+async def run_bots(bots, per_game, host, port, strategy='random', matchmake=False, pool_limit=None,
+                   max_rounds=500, seed=None):
+    """Play bots // per_game matches at once from this process, returns a summary"""
+    pool = HttpPool(host, port, limit=pool_limit)
+    run = '{:x}'.format(random.Random(seed).getrandbits(32))
+    moves = []
+    latencies = []
+
+    async def bot(index):
+        room_id = None if matchmake else 'bots-{}-{}'.format(run, index // per_game)
+        client = AsyncThumbsUpClient(pool, 'bot-{}-{}'.format(run, index), room_id)
+        started = time.perf_counter()
+        if matchmake:
+            await client.find_game()
+        else:
+            await client.join_game()
+        latencies.append(time.perf_counter() - started)
+        return await play(client, STRATEGIES[strategy](None if seed is None else seed + index),
+                          max_rounds, moves.append)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bot(index) for index in range(bots - bots % per_game)),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    await pool.close()
+    errors = [result for result in results if isinstance(result, BaseException)]
+    latencies.sort()
+    return {
+        'bots': len(results),
+        'matches_finished': len({result for result in results if isinstance(result, str)}),
+        'errors': len(errors),
+        'first_error': repr(errors[0]) if errors else None,
+        'moves': len(moves),
+        'moves_per_second': round(len(moves) / elapsed),
+        'requests': pool.requests,
+        'connections_opened': pool.connections_opened,
+        'throttled_retries': pool.retries,
+        'join_p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        'join_p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 1) if latencies else None,
+        'elapsed_seconds': round(elapsed, 2)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run many bot players from one process against a game server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=55556)
+    parser.add_argument('--bots', type=int, default=3000,
+                        help='each waiting bot holds a connection, so against a thread-mode server stay under its '
+                             '--max-workers; raise the server\'s --poll-rate too or bots back off on 429s')
+    parser.add_argument('--per-game', type=int, default=3, help='bots per room, ignored with --matchmake')
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='random')
+    parser.add_argument('--matchmake', action='store_true', help='let /matchmake seat the bots')
+    parser.add_argument('--pool-limit', type=int, default=None, help='cap on open connections')
+    parser.add_argument('--max-rounds', type=int, default=500, help='bets per bot before giving up')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    summary = asyncio.run(run_bots(args.bots, args.per_game, args.host, args.port, args.strategy,
+                                   args.matchmake, args.pool_limit, args.max_rounds, args.seed))
+    for key, value in summary.items():
+        print(f'{key}: {value}')
@@ -0,0 +1,170 @@
+import time
+import asyncio
+from http_parser import HttpRequestParser, HttpParseError
+from events import AsyncSubscriber
+from gamelog import log
+
+
+class AsyncGameServer:
+    """Serve GameHttpServer routing from a single asyncio event loop"""
+
+    def __init__(self, gameserver):
+        self.gameserver = gameserver
+        gameserver.long_poll_blocking = False  # Never block the event loop on a poll
+        self.connections = 0
+
+    async def adopt_connection(self, client_socket, payload):
+        """Serve a connection another worker handed over, starting with its unread bytes"""
+        reader, writer = await asyncio.open_connection(sock=client_socket)
+        await self.handle_connection(reader, writer, payload)
+
+    async def handle_connection(self, reader, writer, initial=b''):
+        client_address = writer.get_extra_info('peername')
+        gameserver = self.gameserver
+        if self.connections >= gameserver.max_connections:
+            # Saturated: answer at once rather than let every connection slow down
+            writer.write(gameserver.overloaded_response('connection_limit'))
+            writer.close()
+            return
+        self.connections += 1
+        gameserver.active_connections.inc()
+        parser = HttpRequestParser()
+        parser.feed(initial)
+        served = 0
+        tracer = gameserver.tracer
+        read_seconds = 0.0
+        trace = None
+        try:
+            while True:
+                if not initial:
+                    # Only waiting for the rest of a started request counts as read time, not idling
+                    partial = tracer is not None and parser.buffer
+                    if partial:
+                        started = time.perf_counter()
+                    try:
+                        data = await asyncio.wait_for(reader.read(65536), gameserver.idle_timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if not data:
+                        break
+                    if partial:
+                        read_seconds += time.perf_counter() - started
+                    parser.feed(data)
+                initial = b''
+
+                # Answer every complete request in the buffer, in order (pipelining)
+                responses = []  # Held back until the moves they acknowledge are durable
+                traces = []
+                durable_seq = 0
+                keep_alive = True
+                try:
+                    while keep_alive:
+                        if tracer is not None:
+                            started = time.perf_counter()
+                        request = parser.next_request()
+                        if request is None:
+                            break
+                        if tracer is not None:
+                            trace = tracer.begin(request.target, read_seconds, time.perf_counter() - started)
+                            read_seconds = 0.0
+                            if trace is not None:
+                                traces.append(trace)
+                        served += 1
+                        keep_alive = request.keep_alive and served < gameserver.max_keepalive_requests
+
+                        # Another worker owns this room, let it take over the connection
+                        owner = gameserver.owner_of(request)
+                        if owner is not None:
+                            await self.send(writer, responses, durable_seq)
+                            payload = request.to_bytes() + bytes(parser.buffer)
+                            if gameserver.cluster.hand_off(writer.get_extra_info('socket'), owner, payload):
+                                return
+
+                        stream = gameserver.event_stream_room(request)
+                        if stream is not None:
+                            await self.send(writer, responses, durable_seq)
+                            await self.stream_events(writer, *stream)
+                            return
+
+                        limited = gameserver.rate_limited(request, client_address, keep_alive)
+                        if limited:
+                            responses.append(limited)
+                            continue
+
+                        # Park long-polls on the room without holding up the loop
+                        poll = gameserver.pending_long_poll(request)
+                        ticket = None if poll else gameserver.pending_matchmake(request)
+                        if poll or ticket:
+                            if responses:
+                                await self.send(writer, responses, durable_seq)  # Don't hold earlier answers
+                            started = time.perf_counter()
+                            if poll:
+                                room, since = poll
+                                await room.wait_for_change_async(since, gameserver.long_poll_timeout)
+                            else:
+                                await gameserver.matchmaker.wait_async(ticket, gameserver.long_poll_timeout)
+                            if trace is not None:
+                                trace.add('wait', time.perf_counter() - started)
+                                tracer.activate(trace)  # Other requests ran meanwhile
+                        responses.append(gameserver.dispatch(request, keep_alive))
+                        durable_seq = gameserver.durable_watermark(request) or durable_seq
+                except HttpParseError as e:
+                    gameserver.parse_errors.inc(e.kode)
+                    responses.append(gameserver.response(e.kode, e.message, '', {}))
+                    keep_alive = False
+                started = time.perf_counter() if traces else 0
+                await self.send(writer, responses, durable_seq)
+                if traces:
+                    tracer.finish(traces, time.perf_counter() - started)
+                if not keep_alive:
+                    break
+        except Exception as e:
+            log.error('error handling client', client=client_address, error=repr(e))
+        finally:
+            writer.close()
+            self.connections -= 1
+            gameserver.active_connections.dec()
+
+    async def send(self, writer, responses, durable_seq):
+        if durable_seq:
+            # Group commit: moves are only acknowledged once the commit thread has fsynced them
+            gameserver = self.gameserver
+            if not await gameserver.journal.wait_durable_async(durable_seq, gameserver.durable_timeout):
+                log.error('event log fsync is late, acknowledging moves anyway', seq=durable_seq)
+        writer.write(b''.join(responses))
+        responses.clear()
+        await writer.drain()
+
+    async def stream_events(self, writer, room, spectate=False):
+        broadcaster = room.spectators if spectate else room.broadcaster
+        subscriber = broadcaster.subscribe(AsyncSubscriber(asyncio.get_running_loop()))
+        try:
+            writer.write(self.gameserver.event_stream_start(room, spectate))
+            await writer.drain()
+            while not subscriber.closed:
+                writer.write(await subscriber.next_frame(self.gameserver.event_heartbeat))
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    async def serve(self, host, port, backlog, reuse_port=False):
+        server = await asyncio.start_server(
+            self.handle_connection, host, port,
+            backlog=backlog, reuse_address=True, reuse_port=reuse_port
+        )
+        if self.gameserver.cluster is not None:
+            self.gameserver.cluster.serve_handoffs_async(self)
+        print(f'Game server (asyncio) started on {host}:{port}')
+        print('Waiting for connections...')
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host='localhost', port=55556, backlog=1024, reuse_port=False):
+        try:
+            asyncio.run(self.serve(host, port, backlog, reuse_port))
+        except KeyboardInterrupt:
+            print('\nShutting down server...')
+        finally:
+            log.flush()
@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from game_state import ThumbsUpGame
+
+ENDPOINTS = ['/join', '/game_state', '/submit_bet', '/submit_thumbs']
+# A spawned server measures throughput, not the per-player /game_state limit
+UNTHROTTLED = ['--poll-rate', '1000000', '--poll-burst', '1000000']
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.matches_finished = 0
+        self.throttled = 0  # 429 and 503 responses, retried after their Retry-After
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, latency, ok):
+        # list.append is atomic, only the counters need the lock
+        self.latencies[endpoint].append(latency)
+        if not ok:
+            with self.lock:
+                self.errors[endpoint] += 1
+
+    def throttle(self):
+        with self.lock:
+            self.throttled += 1
+
+    def finish_match(self):
+        with self.lock:
+            self.matches_finished += 1
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class BotPlayer:
+    """Plays a whole match over one keep-alive connection with random moves"""
+
+    def __init__(self, host, port, room_id, player_id, stats, long_poll=True, max_rounds=500):
+        self.host = host
+        self.port = port
+        self.headers = {'Player-ID': player_id, 'Room-ID': room_id}
+        self.player_id = player_id
+        self.stats = stats
+        self.long_poll = long_poll
+        self.max_rounds = max_rounds
+        self.rng = random.Random(player_id)
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.version = None
+
+    def request(self, method, endpoint, path=None, body=None):
+        headers = dict(self.headers)
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        while True:
+            start = time.perf_counter()
+            try:
+                self.conn.request(method, path or endpoint, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                self.stats.record(endpoint, time.perf_counter() - start, False)
+                self.conn.close()
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+                return None
+            if status not in (429, 503):
+                break
+            # Throttled or shed: not an error, wait as long as the server asked and try again
+            self.stats.throttle()
+            time.sleep(float(response.getheader('Retry-After', 1)))
+        ok = status in (200, 304)
+        self.stats.record(endpoint, time.perf_counter() - start, ok)
+        if status != 200:
+            return None
+        return json.loads(data)
+
+    def get_state(self):
+        path = '/game_state'
+        if self.long_poll and self.version is not None:
+            path = '/game_state?since={}'.format(self.version)
+        state = self.request('GET', '/game_state', path)
+        if state is not None and 'version' in state:
+            self.version = state['version']
+        return state
+
+    def play(self):
+        joined = self.request('GET', '/join')
+        if not joined or joined.get('status') != 'OK':
+            return
+        rounds = 0
+        while rounds < self.max_rounds:
+            state = self.get_state()
+            if state is None:
+                if not self.long_poll:
+                    time.sleep(0.05)
+                continue
+            if state.get('winner'):
+                if state['winner'] == self.player_id:
+                    self.stats.finish_match()
+                return
+            if state['is_my_turn'] and not state['current_bet']:
+                total = sum(state['players'].values())
+                self.request('POST', '/submit_bet', body={
+                    'bet': self.rng.randint(0, total),
+                    'own_thumbs': self.rng.randint(0, state['players'][self.player_id])
+                })
+                rounds += 1
+            elif self.player_id in state['waiting_for_players']:
+                self.request('POST', '/submit_thumbs', body={
+                    'thumbs': self.rng.randint(0, state['players'][self.player_id])
+                })
+            elif not self.long_poll:
+                time.sleep(0.05)
+        self.conn.close()
+
+
+class ProcessMonitor:
+    """Samples CPU time and RSS of a process from /proc (Linux only)"""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.running = True
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.start_cpu = self.cpu_seconds()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def cpu_seconds(self):
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.ticks
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def rss_bytes(self):
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def sample(self):
+        while self.running:
+            rss = self.rss_bytes()
+            if rss:
+                self.peak_rss = max(self.peak_rss, rss)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        end_cpu = self.cpu_seconds()
+        cpu = None
+        if self.start_cpu is not None and end_cpu is not None:
+            cpu = end_cpu - self.start_cpu
+        return {'cpu_seconds': cpu, 'peak_rss_bytes': self.peak_rss or None, 'final_rss_bytes': self.rss_bytes()}
+
+
+def start_server(port, mode, extra_args=()):
+    server = subprocess.Popen(
+        [sys.executable, 'server.py', '--host', '127.0.0.1', '--port', str(port), '--mode', mode, *extra_args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('Server did not start on port {}'.format(port))
+
+
+def run_benchmark(host, port, games, players, long_poll=True, max_rounds=500, server_pid=None):
+    """players bots spread over games rooms as evenly as seats allow"""
+    stats = Stats()
+    run_id = '{:x}'.format(int(time.time() * 1000))
+    bots = []
+    for g in range(games):
+        room_id = 'bench-{}-{}'.format(run_id, g)
+        for p in range(players // games + (g < players % games)):
+            bots.append(BotPlayer(host, port, room_id, 'bot{}-{}'.format(g, p), stats, long_poll, max_rounds))
+
+    monitor = ProcessMonitor(server_pid) if server_pid else None
+    threads = [threading.Thread(target=bot.play, daemon=True) for bot in bots]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    server_usage = monitor.stop() if monitor else None
+
+    total_requests = sum(len(v) for v in stats.latencies.values())
+    total_errors = sum(stats.errors.values())
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        latencies = sorted(stats.latencies[endpoint])
+        endpoints[endpoint] = {
+            'requests': len(latencies),
+            'errors': stats.errors[endpoint],
+            'error_rate': stats.errors[endpoint] / len(latencies) if latencies else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+            'p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+            'p99_ms': percentile(latencies, 99) * 1000 if latencies else None
+        }
+    return {
+        'games': games,
+        'players': len(bots),
+        'long_poll': long_poll,
+        'elapsed_seconds': elapsed,
+        'matches_finished': stats.matches_finished,
+        'total_requests': total_requests,
+        'requests_per_second': total_requests / elapsed if elapsed else 0.0,
+        'error_rate': total_errors / total_requests if total_requests else 0.0,
+        'throttled': stats.throttled,
+        'endpoints': endpoints,
+        'server': server_usage
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless load test for the Thumbs Up game server')
+    parser.add_argument('--players', type=int, default=30, help='total bot players (N), spread over the games with 2-3 per room')
+    parser.add_argument('--games', type=int, default=10, help='concurrent games (M)')
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default='thread',
+                        help='server mode when spawning a local server')
+    parser.add_argument('--host', default=None, help='benchmark an already running server instead')
+    parser.add_argument('--port', type=int, default=55600)
+    parser.add_argument('--poll', action='store_true', help='plain polling instead of long-polling')
+    parser.add_argument('--max-rounds', type=int, default=500, help='bets per bot before giving up')
+    parser.add_argument('--output', default=None, help='write the JSON results to this file')
+    args = parser.parse_args()
+
+    # Every room needs enough players to start and no more than it seats
+    if not args.games * ThumbsUpGame.MIN_PLAYERS <= args.players <= args.games * ThumbsUpGame.MAX_PLAYERS:
+        parser.error('--players must be between {} and {} times --games'.format(
+            ThumbsUpGame.MIN_PLAYERS, ThumbsUpGame.MAX_PLAYERS))
+    server = None
+    host = args.host or '127.0.0.1'
+    if args.host is None:
+        server = start_server(args.port, args.mode, UNTHROTTLED)
+    try:
+        results = run_benchmark(host, args.port, args.games, args.players, not args.poll,
+                                args.max_rounds, server.pid if server else None)
+        results['mode'] = args.mode if server else None
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
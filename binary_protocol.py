@@ -0,0 +1,510 @@
+import sys
+import time
+import json
+import socket
+import struct
+import argparse
+import threading
+from admission import WorkerPool
+from game_registry import RegistryFull, DEFAULT_ROOM
+from gamelog import log
+
+# Every message is framed as  <H body length> <B message type> <body>
+FRAME = struct.Struct('<HB')
+
+# Client -> server
+MSG_JOIN = 1  # <B len> room id <B len> player id, binds the connection to that seat
+MSG_STATE = 2  # <i since>, -1 answers at once, a version long-polls like /game_state?since=
+MSG_BET = 3  # <b bet> <b own thumbs>
+MSG_THUMBS = 4  # <b thumbs>
+
+# Server -> client
+MSG_RESULT = 0x81  # RESULT body
+MSG_STATE_REPLY = 0x82  # STATE_HEAD body, then per seat <b thumbs> <B len> player id
+MSG_NOT_MODIFIED = 0x83  # <I version>
+
+RESULT = struct.Struct('<BBb')  # status, flags, seat (next turn or winner, -1 for none)
+STATE_HEAD = struct.Struct('<IBbbbbBB')  # version, flags, turn seat, winner seat, bet, own thumbs, waiting mask, seats
+SINCE = struct.Struct('<i')
+BET = struct.Struct('<bb')
+THUMBS = struct.Struct('<b')
+VERSION = struct.Struct('<I')
+
+STATUS_OK = 0
+STATUS_NOT_JOINED = 1
+STATUS_REJECTED = 2  # Game full, not your turn, already submitted
+STATUS_ROOM_NOT_FOUND = 3
+STATUS_BAD_MESSAGE = 4
+STATUS_BUSY = 5  # Connection shed or polling too fast, retry later
+
+# RESULT flags
+RESULT_GAME_STARTED = 1
+RESULT_ROUND_EVALUATED = 2
+RESULT_GAME_OVER = 4
+
+# STATE flags
+STATE_STARTED = 1
+STATE_MY_TURN = 2
+STATE_HAS_BET = 4
+
+NO_SEAT = -1
+UNKNOWN_BET = -128  # Bets placed over HTTP are not type checked and may not fit a byte
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(msg_type, body=b''):
+    return FRAME.pack(len(body), msg_type) + body
+
+
+def encode_str(value):
+    value = value.encode()
+    if len(value) > 255:
+        raise ProtocolError('string too long')
+    return bytes((len(value),)) + value
+
+
+def decode_str(body, offset):
+    length = body[offset]
+    end = offset + 1 + length
+    if end > len(body):
+        raise ProtocolError('truncated string')
+    return body[offset + 1:end].decode(), end
+
+
+def encode_join(room_id, player_id):
+    return encode_frame(MSG_JOIN, encode_str(room_id or '') + encode_str(player_id))
+
+
+def decode_join(body):
+    room_id, offset = decode_str(body, 0)
+    player_id, offset = decode_str(body, offset)
+    return room_id or DEFAULT_ROOM, player_id
+
+
+def small_int(value):
+    return value if type(value) is int and -128 < value < 128 else UNKNOWN_BET
+
+
+def seat_of(game, player_id):
+    try:
+        return game.seats.index(player_id)
+    except ValueError:
+        return NO_SEAT
+
+
+def encode_state(game, player_id):
+    # Caller must hold the room lock
+    flags = 0
+    if game.game_started:
+        flags |= STATE_STARTED
+    if player_id == game.current_turn:
+        flags |= STATE_MY_TURN
+    bet = own_thumbs = 0
+    if game.current_bet:
+        flags |= STATE_HAS_BET
+        bet = small_int(game.current_bet['bet'])
+        own_thumbs = small_int(game.current_bet['own_thumbs'])
+    waiting = 0
+    for seat, seat_player in enumerate(game.seats):
+        if seat_player in game.pending:
+            waiting |= 1 << seat
+    turn = NO_SEAT if game.turn_index is None else game.turn_index
+    winner = NO_SEAT if game.winner is None else seat_of(game, game.winner)
+    parts = [STATE_HEAD.pack(game.version, flags, turn, winner, bet, own_thumbs, waiting, len(game.seats))]
+    for seat_player in game.seats:
+        parts.append(THUMBS.pack(game.players[seat_player]))
+        parts.append(encode_str(seat_player))
+    return encode_frame(MSG_STATE_REPLY, b''.join(parts))
+
+
+def decode_state(body, room_id=None):
+    """STATE reply as the same dict /game_state returns"""
+    version, flags, turn, winner, bet, own_thumbs, waiting, count = STATE_HEAD.unpack_from(body)
+    offset = STATE_HEAD.size
+    seats = []
+    players = {}
+    for _ in range(count):
+        (thumbs,) = THUMBS.unpack_from(body, offset)
+        player_id, offset = decode_str(body, offset + THUMBS.size)
+        seats.append(player_id)
+        players[player_id] = thumbs
+    current_turn = seats[turn] if turn != NO_SEAT else None
+    current_bet = None
+    if flags & STATE_HAS_BET:
+        current_bet = {'player': current_turn, 'bet': bet, 'own_thumbs': own_thumbs}
+    return {
+        'status': 'OK',
+        'room_id': room_id,
+        'version': version,
+        'players': players,
+        'current_turn': current_turn,
+        'current_bet': current_bet,
+        'winner': seats[winner] if winner != NO_SEAT else None,
+        'waiting_for_players': [p for seat, p in enumerate(seats) if waiting & (1 << seat)],
+        'is_my_turn': bool(flags & STATE_MY_TURN)
+    }
+
+
+class FrameReader:
+    """Incremental frame splitter, feed() it bytes and pull (type, body) pairs"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_frame(self):
+        if len(self.buffer) < FRAME.size:
+            return None
+        length, msg_type = FRAME.unpack_from(self.buffer)
+        end = FRAME.size + length
+        if len(self.buffer) < end:
+            return None
+        body = bytes(self.buffer[FRAME.size:end])
+        del self.buffer[:end]
+        return msg_type, body
+
+
+class BinaryGameServer:
+    """Length-prefixed binary front end to the same rooms and moves as the HTTP server"""
+
+    def __init__(self, gameserver):
+        self.gameserver = gameserver
+        self.registry = gameserver.registry
+        self.messages = gameserver.metrics.counter(
+            'game_binary_messages_total', 'Binary protocol messages handled', ('type',))
+        self.pool = None
+
+    def result(self, status, flags=0, seat=NO_SEAT):
+        return encode_frame(MSG_RESULT, RESULT.pack(status, flags, seat))
+
+    # Moves run through GameRoom.execute() like the HTTP ones
+
+    def bet_move(self, game, room, player_id, bet, own_thumbs):
+        return room.apply('submit_bet', player_id, bet, own_thumbs)
+
+    def thumbs_move(self, game, room, player_id, thumbs):
+        if not room.apply('submit_thumbs', player_id, thumbs):
+            return self.result(STATUS_REJECTED)
+        if not game.all_thumbs_submitted():
+            return self.result(STATUS_OK)
+        game_over = room.apply('evaluate_round')
+        self.gameserver.rounds_evaluated.inc()
+        if game_over:
+            return self.result(STATUS_OK, RESULT_ROUND_EVALUATED | RESULT_GAME_OVER, seat_of(game, game.winner))
+        return self.result(STATUS_OK, RESULT_ROUND_EVALUATED, game.turn_index)
+
+    def handle_message(self, session, msg_type, body):
+        """Answer one message; session is [room, player_id] once joined"""
+        self.messages.inc(msg_type)
+        if msg_type == MSG_JOIN:
+            room_id, player_id = decode_join(body)
+            try:
+                room = self.registry.get_or_create_room(room_id)
+            except RegistryFull:
+                return self.result(STATUS_REJECTED)
+            joined, game_started = room.execute(self.gameserver.join_move, room, player_id)
+            flags = RESULT_GAME_STARTED if game_started else 0
+            if not joined:
+                return self.result(STATUS_REJECTED)
+            session[:] = [room, player_id]
+            self.gameserver.sessions.touch(player_id, room_id)
+            return self.result(STATUS_OK, flags)
+
+        if not session:
+            return self.result(STATUS_NOT_JOINED)
+        room, player_id = session
+        self.gameserver.sessions.touch(player_id, room.room_id)
+        if room.room_id not in self.registry.rooms:
+            return self.result(STATUS_ROOM_NOT_FOUND)
+
+        if msg_type == MSG_STATE:
+            (since,) = SINCE.unpack(body)
+            if self.gameserver.poll_limiter.acquire(player_id):
+                self.gameserver.shed.inc('rate_limited')
+                return self.result(STATUS_BUSY)
+            with room.lock:
+                # Hold the request until the state moves past the client's version
+                if since >= 0:
+                    room.wait_for_change(since, self.gameserver.long_poll_timeout)
+                if since == room.game.version:
+                    return encode_frame(MSG_NOT_MODIFIED, VERSION.pack(since))
+                return encode_state(room.game, player_id)
+
+        if msg_type == MSG_BET:
+            bet, own_thumbs = BET.unpack(body)
+            if self.gameserver.invalid_move(room, player_id, bet=bet, own_thumbs=own_thumbs):
+                return self.result(STATUS_BAD_MESSAGE)
+            if not room.execute(self.bet_move, room, player_id, bet, own_thumbs):
+                return self.result(STATUS_REJECTED)
+            return self.result(STATUS_OK)
+
+        if msg_type == MSG_THUMBS:
+            (thumbs,) = THUMBS.unpack(body)
+            if self.gameserver.invalid_move(room, player_id, thumbs=thumbs):
+                return self.result(STATUS_BAD_MESSAGE)
+            return room.execute(self.thumbs_move, room, player_id, thumbs)
+
+        raise ProtocolError('unknown message type {}'.format(msg_type))
+
+    def handle_client(self, client_socket, client_address):
+        self.gameserver.active_connections.inc()
+        client_socket.settimeout(self.gameserver.idle_timeout)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = FrameReader()
+        session = []
+        try:
+            while True:
+                try:
+                    data = client_socket.recv(65536)
+                except socket.timeout:
+                    break
+                if not data:
+                    break
+                reader.feed(data)
+                # Answer everything already buffered in one send
+                responses = []
+                durable_seq = 0
+                while True:
+                    frame = reader.next_frame()
+                    if frame is None:
+                        break
+                    try:
+                        responses.append(self.handle_message(session, *frame))
+                    except (ProtocolError, struct.error, IndexError, UnicodeDecodeError):
+                        responses.append(self.result(STATUS_BAD_MESSAGE))
+                    if frame[0] != MSG_STATE and self.gameserver.journal is not None:
+                        durable_seq = self.gameserver.journal.seq
+                self.gameserver.wait_durable(durable_seq)
+                if responses:
+                    client_socket.sendall(b''.join(responses))
+        except Exception as e:
+            log.error('error handling binary client', client=client_address, error=repr(e))
+        finally:
+            client_socket.close()
+            self.gameserver.active_connections.dec()
+
+    def admit(self, client_socket, client_address):
+        # Same shedding as GameHttpServer.admit(), answered with a BUSY result instead of a 503
+        if self.pool.saturated():
+            reason = 'pool_busy'
+        elif self.pool.submit(client_socket, client_address):
+            return
+        else:
+            reason = 'queue_full'
+        self.gameserver.shed.inc(reason)
+        try:
+            client_socket.settimeout(1)
+            client_socket.sendall(self.result(STATUS_BUSY))
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+
+    def accept_loop(self, server_socket):
+        while True:
+            client_socket, client_address = server_socket.accept()
+            self.admit(client_socket, client_address)
+
+    def start(self, host, port, backlog=1024):
+        """Bind the binary port and serve it from a background thread, next to either HTTP mode"""
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((host, port))
+        server_socket.listen(backlog)
+        print(f'Binary protocol listening on {host}:{port}')
+        # Its own pool, sized by the same --max-workers and --accept-queue limits as the HTTP one
+        self.pool = WorkerPool(self.handle_client, self.gameserver.max_workers, self.gameserver.accept_queue)
+        self.pool.start()
+        threading.Thread(target=self.accept_loop, args=(server_socket,), daemon=True).start()
+        return server_socket
+
+
+class BinaryConnection:
+    """Blocking client side of the protocol, one request in flight at a time"""
+
+    def __init__(self, host, port, timeout=30):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = FrameReader()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def call(self, frame):
+        self.sock.sendall(frame)
+        self.bytes_sent += len(frame)
+        while True:
+            reply = self.reader.next_frame()
+            if reply is not None:
+                self.bytes_received += FRAME.size + len(reply[1])
+                return reply
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError('server closed the connection')
+            self.reader.feed(data)
+
+    def result(self, frame):
+        msg_type, body = self.call(frame)
+        if msg_type != MSG_RESULT:
+            raise ProtocolError('expected a result, got type {}'.format(msg_type))
+        return RESULT.unpack(body)
+
+    def join(self, room_id, player_id):
+        return self.result(encode_join(room_id, player_id))
+
+    def state(self, since=-1):
+        """(version, body) of a STATE reply, or (since, None) when nothing changed"""
+        msg_type, body = self.call(encode_frame(MSG_STATE, SINCE.pack(since)))
+        if msg_type == MSG_RESULT:
+            raise ProtocolError('state refused with status {}'.format(RESULT.unpack(body)[0]))
+        if msg_type == MSG_NOT_MODIFIED:
+            return VERSION.unpack(body)[0], None
+        if msg_type != MSG_STATE_REPLY:
+            raise ProtocolError('expected state, got type {}'.format(msg_type))
+        return VERSION.unpack_from(body)[0], body
+
+    def submit_bet(self, bet, own_thumbs):
+        return self.result(encode_frame(MSG_BET, BET.pack(bet, own_thumbs)))
+
+    def submit_thumbs(self, thumbs):
+        return self.result(encode_frame(MSG_THUMBS, THUMBS.pack(thumbs)))
+
+    def close(self):
+        self.sock.close()
+
+
+class RawHttpConnection:
+    """Minimal keep-alive HTTP client that counts wire bytes, the lean end of what a bot would send"""
+
+    def __init__(self, host, port, player_id, room_id):
+        self.address = (host, port)
+        self.connect()
+        self.host = '{}:{}'.format(host, port)
+        self.player_id = player_id
+        self.room_id = room_id
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def request(self, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        head = ('{} {} HTTP/1.1\r\nHost: {}\r\nPlayer-ID: {}\r\nRoom-ID: {}\r\n'
+                .format(method, path, self.host, self.player_id, self.room_id))
+        if data is not None:
+            head += 'Content-Type: application/json\r\nContent-Length: {}\r\n'.format(len(body))
+        request = (head + '\r\n').encode() + body
+        self.sock.sendall(request)
+        self.bytes_sent += len(request)
+
+        while b'\r\n\r\n' not in self.buffer:
+            self.buffer += self.recv()
+        head, _, rest = self.buffer.partition(b'\r\n\r\n')
+        length = 0
+        close = False
+        for line in head.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            name = name.strip().lower()
+            if name == b'content-length':
+                length = int(value)
+            elif name == b'connection':
+                close = value.strip().lower() == b'close'
+        while len(rest) < length:
+            rest += self.recv()
+        self.buffer = rest[length:]
+        self.bytes_received += len(head) + 4 + length
+        if close:
+            # The server caps requests per connection, open a fresh one like any client would
+            self.close()
+            self.connect()
+        return json.loads(rest[:length]) if length else None
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, timeout=30)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = b''
+
+    def recv(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError('server closed the connection')
+        return data
+
+    def close(self):
+        self.sock.close()
+
+
+def play_rounds(bettor, caller, rounds, state):
+    # The bettor always bets 99, so nobody loses a thumb and the game never ends
+    for _ in range(rounds):
+        state(bettor)
+        bettor.submit_bet(99, 1)
+        state(caller)
+        caller.submit_thumbs(1)
+        bettor, caller = caller, bettor
+
+
+def measure(port, binary_port, protocol, rounds, server_pid):
+    from benchmark import ProcessMonitor
+
+    room_id = 'proto-{}-{}'.format(protocol, time.time_ns())
+    if protocol == 'binary':
+        players = [BinaryConnection('127.0.0.1', binary_port) for _ in range(2)]
+        for index, player in enumerate(players):
+            player.join(room_id, 'p{}'.format(index))
+
+        def state(player):
+            return player.state()
+    else:
+        players = [RawHttpConnection('127.0.0.1', port, 'p{}'.format(index), room_id) for index in range(2)]
+        for player in players:
+            player.request('GET', '/join')
+            player.submit_bet = lambda bet, own, player=player: player.request(
+                'POST', '/submit_bet', {'bet': bet, 'own_thumbs': own})
+            player.submit_thumbs = lambda thumbs, player=player: player.request(
+                'POST', '/submit_thumbs', {'thumbs': thumbs})
+
+        def state(player):
+            return player.request('GET', '/game_state')
+
+    for player in players:
+        player.bytes_sent = player.bytes_received = 0
+    monitor = ProcessMonitor(server_pid)
+    start = time.perf_counter()
+    play_rounds(players[0], players[1], rounds, state)
+    elapsed = time.perf_counter() - start
+    cpu = monitor.stop()['cpu_seconds']
+    for player in players:
+        player.close()
+
+    # A move is a bet or a thumbs submission plus the state read that preceded it
+    moves = rounds * 2
+    return {
+        'bytes_sent_per_move': sum(p.bytes_sent for p in players) / moves,
+        'bytes_received_per_move': sum(p.bytes_received for p in players) / moves,
+        'server_cpu_us_per_move': cpu / moves * 1e6 if cpu is not None else None,
+        'latency_us_per_move': elapsed / moves * 1e6
+    }
+
+
+if __name__ == '__main__':
+    from benchmark import start_server, UNTHROTTLED
+
+    parser = argparse.ArgumentParser(description='Compare bytes and server CPU per move, HTTP vs binary protocol')
+    parser.add_argument('--port', type=int, default=55580)
+    parser.add_argument('--binary-port', type=int, default=55581)
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    server = start_server(args.port, 'thread', ['--binary-port', str(args.binary_port)] + UNTHROTTLED)
+    try:
+        for protocol in ('http', 'binary'):
+            print(protocol)
+            for key, value in measure(args.port, args.binary_port, protocol, args.rounds, server.pid).items():
+                print(f'  {key}: {value:.1f}')
+    finally:
+        server.terminate()
+        server.wait()
+    sys.exit(0)
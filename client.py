@@ -1,39 +1,114 @@
+import sys
+import time
 import requests
 import json
-import time
 
 SERVER_URL = 'http://localhost:55556'
+BINARY_SERVER = ('localhost', 55557)  # server.py --binary-port
+LONG_POLL_TIMEOUT = 30  # Must outlast the server's long-poll hold
 
 class ThumbsUpClient:
-    def __init__(self, player_id):
+    def __init__(self, player_id, room_id=None, protocol='http', matchmake=False):
         self.player_id = player_id
+        self.room_id = room_id
         self.headers = {'Player-ID': player_id}
-        self.join_game()
+        if room_id:
+            self.headers['Room-ID'] = room_id  # Omit to play in the default room
+        self.binary = None
+        if protocol == 'binary':
+            from binary_protocol import BinaryConnection
+            self.binary = BinaryConnection(*BINARY_SERVER, timeout=LONG_POLL_TIMEOUT)
+        else:
+            self.session = requests.Session()  # Reuses one keep-alive connection for the match
+        self.state = None
+        self.state_version = None
+        if matchmake:
+            self.find_game()
+        else:
+            self.join_game()
         
     def join_game(self):
-        response = requests.get(f'{SERVER_URL}/join', headers=self.headers)
+        if self.binary:
+            from binary_protocol import STATUS_OK, RESULT_GAME_STARTED
+            status, flags, _ = self.binary.join(self.room_id, self.player_id)
+            if status != STATUS_OK:
+                return {'status': 'ERROR', 'message': 'Game full or already joined'}
+            return {'status': 'OK', 'message': 'Joined game', 'player_id': self.player_id,
+                    'room_id': self.room_id, 'game_started': bool(flags & RESULT_GAME_STARTED)}
+        response = self.request('GET', '/join')
         return response.json()
         
-    def get_game_state(self):
-        response = requests.get(f'{SERVER_URL}/game_state', headers=self.headers)
-        return response.json()
+    def find_game(self):
+        """Queue for matchmaking until the server seats us in a new room"""
+        if self.binary:
+            raise ValueError('matchmaking is only available over HTTP')
+        while True:
+            response = self.request('GET', '/matchmake', timeout=LONG_POLL_TIMEOUT).json()
+            if response['status'] == 'OK':
+                self.room_id = response['room_id']
+                self.headers['Room-ID'] = self.room_id
+                return response
+            if response['status'] != 'QUEUED':
+                raise RuntimeError(response.get('message', 'matchmaking failed'))
+
+    def get_game_state(self, since=None):
+        if self.binary:
+            from binary_protocol import decode_state
+            _, body = self.binary.state(since if since is not None else -1)
+            if body is None:
+                return self.state
+            self.state = decode_state(body, self.room_id)
+            self.state_version = self.state['version']
+            return self.state
+        params = {'since': since} if since is not None else None
+        response = self.request('GET', '/game_state', params=params, timeout=LONG_POLL_TIMEOUT)
+        if response.status_code == 304:
+            return self.state  # Nothing changed while the server held the poll
+        self.state = response.json()
+        self.state_version = self.state.get('version')
+        return self.state
+
+    def request(self, method, path, **kwargs):
+        # Throttled (429) or shed (503) requests are retried once the server's Retry-After has passed
+        while True:
+            response = self.session.request(method, f'{SERVER_URL}{path}', headers=self.headers, **kwargs)
+            if response.status_code not in (429, 503):
+                return response
+            time.sleep(float(response.headers.get('Retry-After', 1)))
+
+    def wait_for_update(self):
+        # Long-poll: the server answers as soon as the state moves past our version
+        return self.get_game_state(since=self.state_version)
         
+    def binary_result(self, result, error):
+        from binary_protocol import STATUS_OK, RESULT_ROUND_EVALUATED, RESULT_GAME_OVER
+        status, flags, seat = result
+        if status != STATUS_OK:
+            return {'status': 'ERROR', 'message': error}
+        response_data = {'status': 'OK'}
+        if flags & RESULT_ROUND_EVALUATED:
+            # Seats are numbered in join order, the same order as the players dict
+            seats = list(self.state['players']) if self.state else []
+            player = seats[seat] if 0 <= seat < len(seats) else None
+            if flags & RESULT_GAME_OVER:
+                response_data['game_over'] = True
+                response_data['winner'] = player
+            else:
+                response_data['next_turn'] = player
+        return response_data
+
     def submit_bet(self, bet, own_thumbs):
+        if self.binary:
+            return self.binary_result(self.binary.submit_bet(bet, own_thumbs), 'Not your turn')
         data = {'bet': bet, 'own_thumbs': own_thumbs}
-        response = requests.post(
-            f'{SERVER_URL}/submit_bet',
-            headers=self.headers,
-            json=data
-        )
+        response = self.request('POST', '/submit_bet', json=data)
         return response.json()
         
     def submit_thumbs(self, thumbs):
+        if self.binary:
+            return self.binary_result(self.binary.submit_thumbs(thumbs), 'Cannot submit thumbs')
         data = {'thumbs': thumbs}
-        response = requests.post(
-            f'{SERVER_URL}/submit_thumbs',
-            headers=self.headers,
-            json=data
-        )
+        response = self.request('POST', '/submit_thumbs', json=data)
         return response.json()
 
     def get_status_message(self, state):
@@ -51,8 +126,8 @@ class ThumbsUpClient:
         return "🎉 You Win!" if is_winner else "😢 You Lose!"
 
     def play_turn(self):
+        state = self.get_game_state()
         while True:
-            state = self.get_game_state()
             print(self.get_status_message(state))  # Print status message
 
             if state.get('winner'):
@@ -68,10 +143,9 @@ class ThumbsUpClient:
                 
                 # Wait until round is evaluated
                 while True:
-                    state = self.get_game_state()
+                    state = self.wait_for_update()
                     if not state['current_bet'] or state.get('winner'):
                         break
-                    time.sleep(1)
             else:
                 if state['current_bet'] and self.player_id in state['waiting_for_players']:
                     print(f"\nPlayer {state['current_turn']} has bet {state['current_bet']['bet']}")
@@ -81,15 +155,40 @@ class ThumbsUpClient:
                     
                     # Wait until round is evaluated
                     while True:
-                        state = self.get_game_state()
+                        state = self.wait_for_update()
                         if not state['current_bet'] or state.get('winner'):
                             break
-                        time.sleep(1)
                 else:
                     print("Waiting for current player to make a bet...")
-                    time.sleep(1)
+                    state = self.wait_for_update()
+
+def spectate(room_id=None):
+    """Watch a room without taking a seat, printing each state the server pushes"""
+    room_id = room_id or 'default'
+    with requests.get(f'{SERVER_URL}/rooms/{room_id}/spectate', stream=True) as response:
+        if response.status_code != 200:
+            print(f"Room {room_id} not found")
+            return
+        for line in response.iter_lines(chunk_size=1):
+            if not line.startswith(b'data: '):
+                continue  # Event names, ids and heartbeats
+            state = json.loads(line[6:])
+            players = ', '.join(f'{p}: {t}' for p, t in state['players'].items())
+            print(f"[v{state['version']}] players {players} | turn {state['current_turn']} | bet {state['current_bet']}")
+            if state['winner']:
+                print(f"Game over! {state['winner']} wins!")
+                return
 
 if __name__ == '__main__':
+    if '--spectate' in sys.argv:
+        spectate(input("Enter room ID to watch (leave blank for default room): ").strip())
+        sys.exit(0)
     player_id = input("Enter your player ID: ")
-    client = ThumbsUpClient(player_id)
+    room_id = input("Enter room ID (leave blank for default room, 'auto' for matchmaking): ").strip()
+    protocol = 'binary' if '--binary' in sys.argv else 'http'
+    if room_id == 'auto':
+        client = ThumbsUpClient(player_id, protocol=protocol, matchmake=True)
+        print(f"Matched into room {client.room_id}")
+    else:
+        client = ThumbsUpClient(player_id, room_id, protocol)
     client.play_turn()
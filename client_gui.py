@@ -1,12 +1,59 @@
+import time
+STARTED = time.perf_counter()  # Before the heavy imports, for the startup report
+
 import tkinter as tk
 from tkinter import messagebox
-from PIL import Image, ImageTk
 import threading
+import queue
 import requests
-import time
+import json
 import os
+from assets import AssetCache
 
 SERVER_URL = 'http://localhost:55556'
+USE_EVENT_STREAM = True  # Render from /events pushes instead of long-polling /game_state
+LONG_POLL_TIMEOUT = 30  # Must outlast the server's long-poll hold
+REQUEST_TIMEOUT = 10  # Joins and moves, these should answer right away
+RESULT_POLL_MS = 30  # How often the Tk thread picks up network results
+ASSET_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'thumbsup')  # None: no scaled copies on disk
+
+class NetworkWorker:
+    """Runs HTTP calls on a background thread, callbacks run on the Tk thread"""
+
+    def __init__(self, root):
+        self.root = root
+        self.session = requests.Session()  # Only ever used by the worker thread
+        self.requests = queue.Queue()
+        self.results = queue.Queue()  # (callback, args) waiting for the Tk thread
+        threading.Thread(target=self.run, daemon=True).start()
+        self.root.after(RESULT_POLL_MS, self.deliver)
+
+    def submit(self, method, path, headers, callback, **kwargs):
+        """Queue a request, callback(response_json, error) runs on the Tk thread"""
+        self.requests.put((method, path, dict(headers), kwargs, callback))
+
+    def run(self):
+        while True:
+            method, path, headers, kwargs, callback = self.requests.get()
+            try:
+                response = self.session.request(method, f'{SERVER_URL}{path}', headers=headers,
+                                                timeout=REQUEST_TIMEOUT, **kwargs)
+                self.post(callback, response.json(), None)
+            except (requests.RequestException, ValueError) as e:
+                self.post(callback, None, e)
+
+    def post(self, callback, *args):
+        # Safe from any thread, Tk widgets must only be touched from deliver()
+        self.results.put((callback, args))
+
+    def deliver(self):
+        while True:
+            try:
+                callback, args = self.results.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args)
+        self.root.after(RESULT_POLL_MS, self.deliver)
 
 class ThumbsUpClientGUI:
     def __init__(self, root):
@@ -15,11 +62,12 @@ class ThumbsUpClientGUI:
         self.root.geometry("400x550")
         self.root.resizable(False, False)
 
+        # Images are decoded and scaled once, screens ask the cache when they are shown
+        self.assets = AssetCache(ASSET_CACHE_DIR)
+
         # Load background image
-        bg_path = "thumb.png"
-        if os.path.exists(bg_path):
-            self.bg_image = Image.open(bg_path).resize((400, 550))
-            self.bg_photo = ImageTk.PhotoImage(self.bg_image)
+        self.bg_photo = self.assets.photo("thumb.png", (400, 550))
+        if self.bg_photo is not None:
             self.bg_label = tk.Label(self.root, image=self.bg_photo)
             self.bg_label.place(x=0, y=0, relwidth=1, relheight=1)
 
@@ -30,15 +78,23 @@ class ThumbsUpClientGUI:
         self.player_id = ""
         self.headers = {}
         self.current_phase = None
+        self.network = NetworkWorker(root)
+        self.generation = 0  # Bumped per joined game so a previous game's listener is ignored
+        self.rendered = {}  # {widget: text} last shown, labels are only touched when this changes
+        self.rendered_version = None
 
         self.setup_login_screen()
+        self.root.after_idle(self.report_startup)
+
+    def report_startup(self):
+        elapsed = (time.perf_counter() - STARTED) * 1000
+        print(f"Startup took {elapsed:.0f} ms, images: {self.assets.stats()}")
 
     def setup_login_screen(self):
         self.clear_frame()
 
-        if os.path.exists("like.png"):
-            thumb_icon = Image.open("like.png").resize((60, 60))
-            self.thumb_photo = ImageTk.PhotoImage(thumb_icon)
+        self.thumb_photo = self.assets.photo("like.png", (60, 60))
+        if self.thumb_photo is not None:
             tk.Label(self.frame, image=self.thumb_photo, bg="white").pack(pady=(10, 0))
 
         tk.Label(self.frame, text="👍 THUMBS UP GAME", font=("Arial", 16, "bold"), bg="white", fg="#2196F3").pack(pady=10)
@@ -47,8 +103,13 @@ class ThumbsUpClientGUI:
         self.entry_player_id = tk.Entry(self.frame, font=("Arial", 12), fg="black", relief="solid", bd=1)
         self.entry_player_id.pack(pady=5)
 
-        tk.Button(self.frame, text="Join Game", command=self.join_game,
-                  bg="#4CAF50", fg="white", font=("Arial", 11), width=20, relief="flat").pack(pady=15)
+        tk.Label(self.frame, text="Room ID (optional)", font=("Arial", 10), bg="white").pack(pady=(10, 0))
+        self.entry_room_id = tk.Entry(self.frame, font=("Arial", 12), fg="black", relief="solid", bd=1)
+        self.entry_room_id.pack(pady=5)
+
+        self.button_join = tk.Button(self.frame, text="Join Game", command=self.join_game,
+                                     bg="#4CAF50", fg="white", font=("Arial", 11), width=20, relief="flat")
+        self.button_join.pack(pady=15)
 
         self.footer = tk.Label(self.frame, text="Created by Team 15", font=("Arial", 8), bg="white", fg="gray")
         self.footer.pack(side="bottom", pady=5)
@@ -56,26 +117,39 @@ class ThumbsUpClientGUI:
     def join_game(self):
         self.player_id = self.entry_player_id.get()
         self.headers = {'Player-ID': self.player_id}
-        try:
-            response = requests.get(f'{SERVER_URL}/join', headers=self.headers).json()
-            if response['status'] == 'OK':
-                self.setup_game_screen()
-                threading.Thread(target=self.update_game_state, daemon=True).start()
-            else:
-                messagebox.showerror("Error", response['message'])
-        except Exception:
+        room_id = self.entry_room_id.get().strip()
+        if room_id:
+            self.headers['Room-ID'] = room_id
+        self.button_join.config(state="disabled")
+        self.network.submit('GET', '/join', self.headers, self.on_joined)
+
+    def on_joined(self, response, error):
+        if error is not None:
+            self.button_join.config(state="normal")
             messagebox.showerror("Connection Error", "Failed to connect to server.")
+            return
+        if response['status'] != 'OK':
+            self.button_join.config(state="normal")
+            messagebox.showerror("Error", response['message'])
+            return
+        self.generation += 1
+        self.setup_game_screen()
+        target = self.listen_events if USE_EVENT_STREAM else self.update_game_state
+        threading.Thread(target=target, args=(self.generation, dict(self.headers)), daemon=True).start()
 
     def setup_game_screen(self):
         self.clear_frame()
 
-        if os.path.exists("thumb_icon.png"):
-            thumb_icon = Image.open("thumb_icon.png").resize((60, 60))
-            self.thumb_photo = ImageTk.PhotoImage(thumb_icon)
+        self.thumb_photo = self.assets.photo("thumb_icon.png", (60, 60))
+        if self.thumb_photo is not None:
             tk.Label(self.frame, image=self.thumb_photo, bg="white").pack(pady=(10, 0))
 
         tk.Label(self.frame, text="👍 THUMBS UP GAME", font=("Arial", 16, "bold"), bg="white", fg="#2196F3").pack(pady=10)
 
+        self.current_phase = None
+        self.rendered = {}
+        self.rendered_version = None
+
         self.label_status = tk.Label(self.frame, text="Game started...", font=("Arial", 12, "bold"), bg="white")
         self.label_status.pack(pady=8)
 
@@ -96,14 +170,94 @@ class ThumbsUpClientGUI:
         self.footer = tk.Label(self.frame, text="Created by Team 15", font=("Arial", 8), bg="white", fg="gray")
         self.footer.pack(side="bottom", pady=5)
 
-    def update_game_state(self):
-        while True:
+    def update_game_state(self, generation, headers):
+        # Runs on its own thread and session, states are handed to the Tk thread
+        session = requests.Session()
+        version = None
+        while generation == self.generation:
             try:
-                state = requests.get(f'{SERVER_URL}/game_state', headers=self.headers).json()
-                self.render_game_state(state)
-                time.sleep(1)
-            except:
-                break
+                # Long-poll: the server holds the request until the state changes
+                params = {'since': version} if version is not None else None
+                response = session.get(f'{SERVER_URL}/game_state', headers=headers,
+                                       params=params, timeout=LONG_POLL_TIMEOUT)
+                if response.status_code == 304:
+                    continue
+                if response.status_code in (429, 503):
+                    # Polled too fast or the server is busy, come back when it says so
+                    time.sleep(float(response.headers.get('Retry-After', 1)))
+                    continue
+                if response.status_code != 200:
+                    self.network.post(self.on_connection_error, generation, f"Server answered {response.status_code}")
+                    return
+                state = response.json()
+                if state.get('status') != 'OK':
+                    self.network.post(self.on_connection_error, generation, state.get('message', 'Server error'))
+                    return
+                version = state.get('version')
+                self.network.post(self.on_state, generation, state)
+                if state.get('winner'):
+                    return
+            except (requests.RequestException, ValueError) as e:
+                self.network.post(self.on_connection_error, generation, f"Lost connection: {e}")
+                return
+
+    def listen_events(self, generation, headers):
+        # Falls back to long-polling /game_state if the stream can't be opened or breaks off
+        if not self.stream_events(generation, headers):
+            self.update_game_state(generation, headers)
+
+    def stream_events(self, generation, headers):
+        """Render pushed states until the game ends (True) or the stream fails (False)"""
+        player_id = headers['Player-ID']
+        try:
+            response = requests.get(f'{SERVER_URL}/events', headers=headers, stream=True,
+                                    timeout=(REQUEST_TIMEOUT, LONG_POLL_TIMEOUT))
+        except requests.RequestException:
+            return False
+        try:
+            if response.status_code != 200:
+                # A stream holds a server thread for the whole match, so a busy server (503)
+                # gets long-polls instead; the long-poll path also reports other errors
+                return False
+            # chunk_size=1: the default waits for 512 bytes, holding back small frames
+            for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+                # Each event carries the full public state, so one data line is enough to render
+                if generation != self.generation:
+                    return True
+                if not line or not line.startswith('data: '):
+                    continue
+                state = json.loads(line[len('data: '):])['state']
+                state['is_my_turn'] = state['current_turn'] == player_id
+                self.network.post(self.on_state, generation, state)
+                if state.get('winner'):
+                    return True
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+        finally:
+            response.close()
+        return False
+
+    def on_connection_error(self, generation, message):
+        if generation != self.generation or not self.label_status.winfo_exists():
+            return
+        self.set_text(self.label_status, f"⚠ {message}")
+        self.current_phase = None
+        self.hide_inputs()
+
+    def on_state(self, generation, state):
+        if generation != self.generation:
+            return  # Listener of a game we already left
+        version = state.get('version')
+        if version is not None and self.rendered_version is not None and version <= self.rendered_version:
+            return  # Already showing this state or a newer one
+        self.rendered_version = version
+        self.render_game_state(state)
+
+    def set_text(self, label, text):
+        # Every config() makes Tk re-layout, skip it when the text is unchanged
+        if self.rendered.get(label) != text:
+            self.rendered[label] = text
+            label.config(text=text)
 
     def render_game_state(self, state):
         if state.get('winner'):
@@ -111,8 +265,8 @@ class ThumbsUpClientGUI:
             self.show_game_over_screen(winner)
             return
 
-        self.label_players.config(text=f"Players: {state['players']}")
-        self.label_turn.config(text=f"Current turn: {state['current_turn']}")
+        self.set_text(self.label_players, f"Players: {state['players']}")
+        self.set_text(self.label_turn, f"Current turn: {state['current_turn']}")
 
         if state['is_my_turn']:
             new_phase = "bet"
@@ -124,13 +278,13 @@ class ThumbsUpClientGUI:
         if self.current_phase != new_phase:
             self.current_phase = new_phase
             if new_phase == "bet":
-                self.label_status.config(text="🎯 It's your turn to bet!")
+                self.set_text(self.label_status, "🎯 It's your turn to bet!")
                 self.show_bet_input()
             elif new_phase == "thumb":
-                self.label_status.config(text=f"🖐 Player {state['current_turn']} bet {state['current_bet']['bet']}")
+                self.set_text(self.label_status, f"🖐 Player {state['current_turn']} bet {state['current_bet']['bet']}")
                 self.show_thumb_input()
             else:
-                self.label_status.config(text="⏳ Waiting for others...")
+                self.set_text(self.label_status, "⏳ Waiting for others...")
                 self.hide_inputs()
 
     def show_bet_input(self):
@@ -139,14 +293,14 @@ class ThumbsUpClientGUI:
         self.entry_thumbs.pack(pady=5)
         self.set_placeholder(self.entry_bet, "Enter your bet")
         self.set_placeholder(self.entry_thumbs, "Thumbs (0-2)")
-        self.button_submit.config(command=self.submit_bet)
+        self.button_submit.config(command=self.submit_bet, state="normal")
         self.button_submit.pack(pady=10)
 
     def show_thumb_input(self):
         self.hide_inputs()
         self.entry_thumbs.pack(pady=5)
         self.set_placeholder(self.entry_thumbs, "Thumbs (0-2)")
-        self.button_submit.config(command=self.submit_thumbs)
+        self.button_submit.config(command=self.submit_thumbs, state="normal")
         self.button_submit.pack(pady=10)
 
     def submit_bet(self):
@@ -158,12 +312,12 @@ class ThumbsUpClientGUI:
         try:
             bet = int(bet_text)
             own_thumbs = int(thumb_text)
-            response = requests.post(f'{SERVER_URL}/submit_bet', headers=self.headers,
-                                     json={'bet': bet, 'own_thumbs': own_thumbs}).json()
-            if response['status'] != 'OK':
-                messagebox.showerror("Error", response['message'])
         except ValueError:
             messagebox.showerror("Invalid Input", "Please enter numbers between 0 and 2.")
+            return
+        self.button_submit.config(state="disabled")  # One move in flight at a time
+        self.network.submit('POST', '/submit_bet', self.headers, self.on_move_result,
+                            json={'bet': bet, 'own_thumbs': own_thumbs})
 
     def submit_thumbs(self):
         thumb_text = self.entry_thumbs.get()
@@ -172,12 +326,21 @@ class ThumbsUpClientGUI:
             return
         try:
             thumbs = int(thumb_text)
-            response = requests.post(f'{SERVER_URL}/submit_thumbs', headers=self.headers,
-                                     json={'thumbs': thumbs}).json()
-            if response['status'] != 'OK':
-                messagebox.showerror("Error", response['message'])
         except ValueError:
             messagebox.showerror("Invalid Input", "Please enter a number between 0 and 2.")
+            return
+        self.button_submit.config(state="disabled")
+        self.network.submit('POST', '/submit_thumbs', self.headers, self.on_move_result,
+                            json={'thumbs': thumbs})
+
+    def on_move_result(self, response, error):
+        if not self.button_submit.winfo_exists():
+            return  # The game ended while the move was in flight
+        self.button_submit.config(state="normal")
+        if error is not None:
+            messagebox.showerror("Connection Error", "Failed to reach the server.")
+        elif response['status'] != 'OK':
+            messagebox.showerror("Error", response['message'])
 
     def set_placeholder(self, entry, placeholder):
         entry.delete(0, tk.END)
@@ -216,9 +379,8 @@ class ThumbsUpClientGUI:
 
         self.frame.config(bg=result_color)
 
-        if os.path.exists(image_path):
-            img = Image.open(image_path).resize((100, 100))
-            self.end_photo = ImageTk.PhotoImage(img)
+        self.end_photo = self.assets.photo(image_path, (100, 100))
+        if self.end_photo is not None:
             tk.Label(self.frame, image=self.end_photo, bg=result_color).pack(pady=(30, 10))
 
         tk.Label(self.frame, text=result_text, font=("Arial", 18, "bold"), bg=result_color).pack(pady=(0, 5))
@@ -0,0 +1,185 @@
+import os
+import json
+import array
+import bisect
+import socket
+import signal
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from urllib.parse import parse_qs
+
+
+def stable_hash(key):
+    # hash() is salted per process, workers need to agree on placement
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of room ids onto worker indexes"""
+
+    def __init__(self, workers, vnodes=64):
+        self.workers = workers
+        points = []
+        for worker in range(workers):
+            for vnode in range(vnodes):
+                points.append((stable_hash('{}-{}'.format(worker, vnode)), worker))
+        points.sort()
+        self.keys = [point for point, _ in points]
+        self.owners = [worker for _, worker in points]
+
+    def lookup(self, room_id):
+        index = bisect.bisect(self.keys, stable_hash(room_id)) % len(self.keys)
+        return self.owners[index]
+
+
+class ClusterNode:
+    """One worker's view of the cluster: who owns which room and how to hand connections over"""
+
+    MAX_HANDOFF = 256 * 1024  # Largest buffered payload passed along with a socket
+
+    def __init__(self, index, ring, socket_paths):
+        self.index = index
+        self.ring = ring
+        self.socket_paths = socket_paths
+        self.handoffs = None  # Unix datagram socket receiving connections from peers
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def owns(self, room_id):
+        return self.ring.lookup(room_id) == self.index
+
+    def owner_of(self, request, resolve_room):
+        """Worker index owning the request's room, or None if it can be served here"""
+        if request.path in ('/rooms', '/stats', '/metrics', '/debug/trace'):
+            if request.method == 'GET':
+                # Each worker reports only its own rooms and metrics, ?worker=N asks a given one
+                worker = parse_qs(request.query).get('worker', [''])[0]
+                if worker.isdigit() and int(worker) < self.ring.workers and int(worker) != self.index:
+                    return int(worker)
+                return None
+            if not request.body:
+                return None
+            try:
+                room_id = json.loads(request.body).get('room_id')
+            except (ValueError, AttributeError):
+                return None
+            if room_id is None:
+                return None  # The registry picks an id this worker owns
+        else:
+            room_id, action = resolve_room(request.path, request.headers)
+            if action == '/matchmake':
+                # Spread the queue by player, so a player's re-polls reach the same worker and the
+                # rooms it forms (create_room picks ids this worker owns) stay spread too
+                room_id = request.header('Player-ID')
+                if not room_id:
+                    return None
+        owner = self.ring.lookup(room_id)
+        return None if owner == self.index else owner
+
+    def hand_off(self, client_socket, owner, payload):
+        """Pass the client connection and its unread bytes to the owning worker"""
+        if len(payload) > self.MAX_HANDOFF:
+            return False
+        # socket.send_fds() drops its address argument, so go through sendmsg() directly
+        fds = array.array('i', [client_socket.fileno()])
+        self.sender.sendmsg([payload], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)], 0, self.socket_paths[owner])
+        return True
+
+    def bind(self):
+        path = self.socket_paths[self.index]
+        if os.path.exists(path):
+            os.unlink(path)
+        self.handoffs = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.handoffs.bind(path)
+
+    def receive(self):
+        payload, fds, _, _ = socket.recv_fds(self.handoffs, self.MAX_HANDOFF, 1)
+        if not fds:
+            return None, payload
+        return socket.socket(fileno=fds[0]), payload
+
+    def serve_handoffs(self, gameserver):
+        """Thread mode: run each received connection on its own thread"""
+        self.bind()
+
+        def loop():
+            while True:
+                client_socket, payload = self.receive()
+                if client_socket is None:
+                    continue
+                try:
+                    client_address = client_socket.getpeername()
+                except OSError:
+                    client_socket.close()
+                    continue
+                gameserver.admit(client_socket, client_address, payload)
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def serve_handoffs_async(self, async_server):
+        """asyncio mode: received connections join the event loop"""
+        self.bind()
+        self.handoffs.setblocking(False)
+        loop = asyncio.get_running_loop()
+
+        def on_readable():
+            while True:
+                try:
+                    client_socket, payload = self.receive()
+                except BlockingIOError:
+                    return
+                if client_socket is not None:
+                    loop.create_task(async_server.adopt_connection(client_socket, payload))
+
+        loop.add_reader(self.handoffs.fileno(), on_readable)
+
+
+def run_worker(index, workers, host, port, backlog, mode, socket_paths, data_dir=None, snapshot_every=100000,
+               limits=None, tracing=None):
+    from server import GameHttpServer
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent handles Ctrl+C
+    gameserver = GameHttpServer()
+    gameserver.configure_limits(**(limits or {}))
+    gameserver.join_cluster(ClusterNode(index, HashRing(workers), socket_paths))
+    if data_dir:
+        # Each worker logs its own rooms; recovery needs the same worker count
+        gameserver.enable_journal(os.path.join(data_dir, 'worker-{}'.format(index)), snapshot_every)
+    if tracing:
+        gameserver.enable_tracing(**tracing)
+    if mode == 'asyncio':
+        gameserver.run_async_server(host, port, backlog, reuse_port=True)
+    else:
+        gameserver.run_server(host, port, backlog, reuse_port=True)
+
+
+def run_cluster(workers, host='localhost', port=55556, backlog=1024, mode='thread', data_dir=None,
+                snapshot_every=100000, limits=None, tracing=None):
+    """Pre-fork N workers sharing the port, each owning a slice of the rooms"""
+    socket_paths = ['/tmp/thumbsup-{}-{}.sock'.format(port, index) for index in range(workers)]
+    context = multiprocessing.get_context('fork')
+    processes = [
+        context.Process(target=run_worker,
+                        args=(index, workers, host, port, backlog, mode, socket_paths, data_dir, snapshot_every,
+                              limits, tracing),
+                        daemon=True)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    if tracing:
+        # Each worker keeps its own traces, pass the dump request on to all of them
+        signal.signal(signal.SIGUSR1, lambda *_: [os.kill(process.pid, signal.SIGUSR1) for process in processes])
+    print(f'Game server cluster started on {host}:{port} with {workers} workers')
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print('\nShutting down server...')
+    finally:
+        for process in processes:
+            process.terminate()
+        for path in socket_paths:
+            if os.path.exists(path):
+                os.unlink(path)
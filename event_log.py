@@ -0,0 +1,384 @@
+import os
+import glob
+import json
+import mmap
+import time
+import zlib
+import pickle
+import struct
+import asyncio
+import argparse
+import threading
+
+# One record per successful mutation:
+#   header  <I payload length> <I crc32 of payload> <Q sequence> <B op>
+#   payload room id, then the op's arguments (strings length-prefixed, numbers as a tagged int32)
+HEADER = struct.Struct('<IIQB')
+STR_LEN = struct.Struct('<H')
+TAGGED_INT = struct.Struct('<Bi')
+TAG_NONE, TAG_INT, TAG_JSON = 0, 1, 2  # Clients may send anything as a bet, keep it replayable
+
+OP_CREATE_ROOM = 1
+OP_REMOVE_ROOM = 2
+OP_ADD_PLAYER = 3
+OP_SUBMIT_BET = 4
+OP_SUBMIT_THUMBS = 5
+OP_EVALUATE_ROUND = 6
+OP_REMOVE_PLAYER = 7
+
+# op: (ThumbsUpGame method, argument kinds)
+GAME_OPS = {
+    OP_ADD_PLAYER: ('add_player', 's'),
+    OP_SUBMIT_BET: ('submit_bet', 'svv'),
+    OP_SUBMIT_THUMBS: ('submit_thumbs', 'sv'),
+    OP_EVALUATE_ROUND: ('evaluate_round', ''),
+    OP_REMOVE_PLAYER: ('remove_player', 's')
+}
+OP_BY_METHOD = {method: (op, kinds) for op, (method, kinds) in GAME_OPS.items()}
+
+
+def encode_payload(room_id, kinds, args):
+    parts = []
+
+    def write_str(value):
+        value = value.encode()
+        parts.append(STR_LEN.pack(len(value)))
+        parts.append(value)
+
+    write_str(room_id)
+    for kind, arg in zip(kinds, args):
+        if kind == 's':
+            write_str(arg)
+        elif arg is None:
+            parts.append(TAGGED_INT.pack(TAG_NONE, 0))
+        elif type(arg) is int and -2 ** 31 <= arg < 2 ** 31:
+            parts.append(TAGGED_INT.pack(TAG_INT, arg))
+        else:
+            parts.append(TAGGED_INT.pack(TAG_JSON, 0))
+            write_str(json.dumps(arg))
+    return b''.join(parts)
+
+
+def decode_payload(buffer, offset, end, kinds):
+    def read_str(offset):
+        (length,) = STR_LEN.unpack_from(buffer, offset)
+        offset += STR_LEN.size
+        return bytes(buffer[offset:offset + length]).decode(), offset + length
+
+    room_id, offset = read_str(offset)
+    args = []
+    for kind in kinds:
+        if kind == 's':
+            value, offset = read_str(offset)
+        else:
+            tag, value = TAGGED_INT.unpack_from(buffer, offset)
+            offset += TAGGED_INT.size
+            if tag == TAG_NONE:
+                value = None
+            elif tag == TAG_JSON:
+                value, offset = read_str(offset)
+                value = json.loads(value)
+        args.append(value)
+    if offset != end:
+        raise ValueError('payload length mismatch')
+    return room_id, args
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+def read_records(path):
+    """Yield (sequence, op, payload buffer, start, end) from a memory-mapped segment, stopping at a torn tail"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        offset = 0
+        while offset + HEADER.size <= size:
+            length, crc, seq, op = HEADER.unpack_from(buffer, offset)
+            start = offset + HEADER.size
+            end = start + length
+            if end > size or zlib.crc32(buffer[start:end]) != crc:
+                return  # Partial write from a crash, everything after it is lost
+            yield seq, op, buffer, start, end
+            offset = end
+
+
+class EventLog:
+    """Append-only binary log of game mutations with group commit and periodic snapshots"""
+
+    def __init__(self, directory, commit_interval=0.002, snapshot_every=100000):
+        self.directory = directory
+        self.commit_interval = commit_interval  # Max seconds an append waits for its fsync batch
+        self.snapshot_every = snapshot_every  # Records between automatic snapshots
+        self.seq = 0
+        self.durable_seq = 0
+        self.pending = []
+        self.lock = threading.Lock()  # Guards seq, pending and the segment reference
+        self.write_lock = threading.Lock()  # Held across taking a batch, writing, fsyncing and rotating
+        self.durable = threading.Condition(threading.Lock())
+        self.async_waiters = []  # [(seq, loop, future)] for wait_durable_async()
+        self.wakeup = threading.Event()
+        self.segment = None
+        self.segment_index = 0
+        self.since_snapshot = 0
+        self.registry = None
+        self.snapshotting = False
+        os.makedirs(directory, exist_ok=True)
+
+    def segment_path(self, index):
+        return os.path.join(self.directory, 'events.{:08d}.log'.format(index))
+
+    def snapshot_path(self, index):
+        return os.path.join(self.directory, 'snapshot.{:08d}.bin'.format(index))
+
+    def indexes(self, pattern):
+        paths = glob.glob(os.path.join(self.directory, pattern))
+        return sorted(int(os.path.basename(path).split('.')[1]) for path in paths)
+
+    # Writing
+
+    def append(self, op, room_id, kinds='', args=()):
+        payload = encode_payload(room_id, kinds, args)
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+            self.pending.append(HEADER.pack(len(payload), zlib.crc32(payload), seq, op) + payload)
+            self.since_snapshot += 1
+        return seq
+
+    def record_game_op(self, room_id, method, args):
+        op, kinds = OP_BY_METHOD[method]
+        return self.append(op, room_id, kinds, args)
+
+    def flush(self):
+        """Write and fsync everything appended so far as one batch"""
+        with self.write_lock:
+            self.flush_batch()
+
+    def flush_batch(self):
+        # Caller must hold self.write_lock, so batches reach the file in order and rotate()
+        # never closes the segment under a write
+        with self.lock:
+            batch, self.pending = self.pending, []
+            seq = self.seq
+            segment = self.segment
+        if batch:
+            segment.write(b''.join(batch))
+            segment.flush()
+            os.fsync(segment.fileno())
+        with self.durable:
+            self.durable_seq = max(self.durable_seq, seq)
+            self.durable.notify_all()
+            waiters = [waiter for waiter in self.async_waiters if waiter[0] <= seq]
+            self.async_waiters = [waiter for waiter in self.async_waiters if waiter[0] > seq]
+        for _, loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def wait_durable(self, seq, timeout=None):
+        """Block until every record up to seq is fsynced, False on timeout"""
+        with self.durable:
+            return self.durable.wait_for(lambda: self.durable_seq >= seq, timeout)
+
+    async def wait_durable_async(self, seq, timeout=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.durable:
+            if self.durable_seq >= seq:
+                return True
+            self.async_waiters.append((seq, loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            with self.durable:
+                if (seq, loop, future) in self.async_waiters:
+                    self.async_waiters.remove((seq, loop, future))
+            return False
+
+    def commit_loop(self):
+        while True:
+            self.wakeup.wait(self.commit_interval)
+            self.wakeup.clear()
+            if self.pending:
+                self.flush()
+            if self.since_snapshot >= self.snapshot_every and not self.snapshotting and self.registry is not None:
+                self.snapshotting = True
+                threading.Thread(target=self.snapshot, daemon=True).start()
+
+    def start(self, registry):
+        """Begin logging for the registry, always into a fresh segment"""
+        self.registry = registry
+        self.segment_index = max(self.indexes('events.*.log') + self.indexes('snapshot.*.bin') + [0]) + 1
+        self.segment = open(self.segment_path(self.segment_index), 'ab')
+        registry.attach_journal(self)
+        threading.Thread(target=self.commit_loop, daemon=True).start()
+
+    def rotate(self):
+        with self.write_lock:
+            self.flush_batch()
+            with self.lock:
+                self.segment.close()
+                self.segment_index += 1
+                self.segment = open(self.segment_path(self.segment_index), 'ab')
+                self.since_snapshot = 0
+                return self.segment_index
+
+    def snapshot(self):
+        """Write a compact snapshot; replay afterwards starts at the segment opened here"""
+        try:
+            index = self.rotate()
+            # Rooms are created and removed under the registry lock together with their log
+            # record, so each one is either listed here or logged into the new segment
+            with self.registry.lock:
+                live = list(self.registry.rooms.values())
+            rooms = []
+            for room in live:
+                with room.lock:
+                    rooms.append((room.room_id, room.last_seq, room.game.to_state()))
+            path = self.snapshot_path(index)
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump({'seq': self.seq, 'rooms': rooms}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+
+            # Older segments and snapshots are fully covered now
+            for old in self.indexes('events.*.log'):
+                if old < index:
+                    os.unlink(self.segment_path(old))
+            for old in self.indexes('snapshot.*.bin'):
+                if old < index:
+                    os.unlink(self.snapshot_path(old))
+            return path
+        finally:
+            self.snapshotting = False
+
+    # Recovery
+
+    def recover(self, registry):
+        """Load the latest snapshot and replay the log tail into the registry, returns records replayed"""
+        from game_registry import GameRoom
+        from game_state import ThumbsUpGame
+
+        start = 0
+        snapshots = self.indexes('snapshot.*.bin')
+        if snapshots:
+            start = snapshots[-1]
+            with open(self.snapshot_path(start), 'rb') as f:
+                snapshot = pickle.load(f)
+            self.seq = snapshot['seq']
+            for room_id, last_seq, state in snapshot['rooms']:
+                room = GameRoom(room_id, ThumbsUpGame.from_state(state))
+                room.last_seq = last_seq
+                registry.adopt_room(room)
+
+        replayed = 0
+        muted = {}  # Nobody can be subscribed yet, skip building event payloads during replay
+        for index in self.indexes('events.*.log'):
+            if index < start:
+                continue
+            for seq, op, buffer, offset, end in read_records(self.segment_path(index)):
+                self.seq = max(self.seq, seq)
+                if op == OP_CREATE_ROOM or op == OP_REMOVE_ROOM:
+                    room_id, _ = decode_payload(buffer, offset, end, '')
+                    room = registry.rooms.get(room_id)
+                    if room is not None and seq <= room.last_seq:
+                        continue
+                    if op == OP_CREATE_ROOM:
+                        room = GameRoom(room_id)
+                        room.last_seq = seq
+                        registry.adopt_room(room)
+                    else:
+                        registry.rooms.pop(room_id, None)
+                    replayed += 1
+                    continue
+                method, kinds = GAME_OPS[op]
+                room_id, args = decode_payload(buffer, offset, end, kinds)
+                room = registry.rooms.get(room_id)
+                if room is None or seq <= room.last_seq:
+                    continue  # Already part of the snapshot
+                if room.game.listeners:
+                    muted[room] = room.game.listeners
+                    room.game.listeners = []
+                getattr(room.game, method)(*args)
+                room.last_seq = seq
+                replayed += 1
+        for room, listeners in muted.items():
+            room.game.listeners = listeners
+        self.durable_seq = self.seq
+        return replayed
+
+
+def benchmark(directory, moves, recovery_events):
+    from game_registry import GameRegistry
+
+    # Moves go through GameRoom.execute() like the server's
+    def seat(game, room):
+        if not game.game_started:
+            room.apply('add_player', 'a')
+            room.apply('add_player', 'b')
+
+    def play_round(game, room):
+        bettor = game.current_turn
+        other = 'b' if bettor == 'a' else 'a'
+        room.apply('submit_bet', bettor, 99, 1)
+        room.apply('submit_thumbs', other, 1)
+        room.apply('evaluate_round')
+
+    def play(registry, count):
+        # Two-player rooms playing bets nobody can hit, so games never end
+        rooms = [registry.get_or_create_room('bench-{}'.format(i)) for i in range(100)]
+        for room in rooms:
+            room.execute(seat, room)
+        done = 0
+        while done < count:
+            for room in rooms:
+                room.execute(play_round, room)
+                done += 3
+        return done
+
+    for path in glob.glob(os.path.join(directory, '*')):
+        os.unlink(path)
+
+    start = time.perf_counter()
+    play(GameRegistry(), moves)
+    plain = (time.perf_counter() - start) / moves
+
+    journal = EventLog(directory, snapshot_every=10 ** 12)
+    registry = GameRegistry()
+    journal.start(registry)
+    start = time.perf_counter()
+    play(registry, moves)
+    logged = (time.perf_counter() - start) / moves
+    journal.wait_durable(journal.seq)
+
+    # Grow the log to the recovery size, then time a cold start
+    play(registry, max(0, recovery_events - journal.seq))
+    journal.wait_durable(journal.seq)
+    events = journal.seq
+    start = time.perf_counter()
+    replayed = EventLog(directory).recover(GameRegistry())
+    recovery = time.perf_counter() - start
+
+    return {
+        'move_us_without_log': plain * 1e6,
+        'move_us_with_log': logged * 1e6,
+        'log_overhead_us_per_move': (logged - plain) * 1e6,
+        'events_in_log': events,
+        'events_replayed': replayed,
+        'recovery_seconds': recovery,
+        'recovery_seconds_per_million_events': recovery / replayed * 1e6 if replayed else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark event log overhead and recovery time')
+    parser.add_argument('--dir', default='/tmp/thumbsup-event-log-bench')
+    parser.add_argument('--moves', type=int, default=300000)
+    parser.add_argument('--recovery-events', type=int, default=1000000)
+    args = parser.parse_args()
+    for key, value in benchmark(args.dir, args.moves, args.recovery_events).items():
+        print(f'{key}: {value}')
@@ -0,0 +1,186 @@
+import json
+import queue
+import asyncio
+import threading
+
+
+def encode_event(event, data, event_id=None):
+    """Serialize one event as a Server-Sent Events frame"""
+    frame = []
+    if event_id is not None:
+        frame.append("id: {}\n".format(event_id))
+    frame.append("event: {}\n".format(event))
+    frame.append("data: {}\n\n".format(json.dumps(data)))
+    return ''.join(frame).encode()
+
+
+HEARTBEAT = b': keep-alive\n\n'
+
+
+class ThreadSubscriber:
+    """Subscriber drained by a blocking connection thread"""
+
+    def __init__(self, max_pending=256):
+        self.frames = queue.Queue(max_pending)
+        self.closed = False
+
+    def push(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            self.closed = True  # Too slow to keep up, drop it
+
+    def next_frame(self, timeout):
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return HEARTBEAT
+
+
+class AsyncSubscriber:
+    """Subscriber drained by a coroutine on the given event loop"""
+
+    def __init__(self, loop, max_pending=256):
+        self.loop = loop
+        self.frames = asyncio.Queue(max_pending)
+        self.closed = False
+
+    def push(self, frame):
+        self.loop.call_soon_threadsafe(self._put, frame)
+
+    def _put(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.closed = True
+
+    async def next_frame(self, timeout):
+        try:
+            return await asyncio.wait_for(self.frames.get(), timeout)
+        except asyncio.TimeoutError:
+            return HEARTBEAT
+
+
+class SocketFanout:
+    """Thread mode /spectate: one thread writes each frame to every viewer socket of a room.
+
+    Viewers never hold a worker. Frames are whole states, so a writer that falls behind
+    skips to the latest one, and a socket whose send buffer is full is dropped rather
+    than waited for.
+    """
+
+    def __init__(self, heartbeat):
+        self.heartbeat = heartbeat
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.latest = None  # Newest frame not yet written
+        self.joining = []  # [(socket, first bytes)] added since the last write
+        self.sockets = []  # Only touched by the writer thread
+        self.closed = False
+
+    @property
+    def connections(self):
+        return len(self.sockets) + len(self.joining)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def add(self, client_socket, first):
+        """Hand over a viewer, first is sent ahead of any later frame; False once closed"""
+        client_socket.setblocking(False)
+        with self.lock:
+            if self.closed:
+                return False
+            self.joining.append((client_socket, first))
+        self.ready.set()
+        return True
+
+    def push(self, frame):
+        with self.lock:
+            self.latest = frame
+        self.ready.set()
+
+    def run(self):
+        while not self.closed:
+            self.ready.wait(self.heartbeat)
+            self.ready.clear()
+            with self.lock:
+                frame, self.latest = self.latest, None
+                joining, self.joining = self.joining, []
+            for client_socket, first in joining:
+                if self.write(client_socket, first):
+                    self.sockets.append(client_socket)
+            if frame is None and not joining:
+                frame = HEARTBEAT  # Woken by the timeout
+            if frame is not None:
+                self.sockets = [client_socket for client_socket in self.sockets if self.write(client_socket, frame)]
+        with self.lock:
+            joining, self.joining = self.joining, []
+        for client_socket in self.sockets + [client_socket for client_socket, _ in joining]:
+            client_socket.close()
+        self.sockets = []
+
+    def write(self, client_socket, frame):
+        try:
+            if client_socket.send(frame) == len(frame):
+                return True
+        except OSError:
+            pass
+        client_socket.close()  # Gone, or too slow to take a whole frame
+        return False
+
+
+class EventBroadcaster:
+    """Encodes each game event once and fans the same bytes out to every subscriber"""
+
+    def __init__(self, on_active=None):
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.closed = False  # Set by close(), later subscribers are closed straight away
+        self.on_active = on_active  # Called with True on the first subscriber, False once the last leaves
+
+    def subscribe(self, subscriber):
+        with self.lock:
+            if self.closed:
+                subscriber.closed = True  # The room is gone
+                return subscriber
+            self.subscribers.append(subscriber)
+            if len(self.subscribers) == 1 and self.on_active is not None:
+                self.on_active(True)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+                if not self.subscribers and self.on_active is not None:
+                    self.on_active(False)
+
+    def audience(self):
+        """Connections reached, a SocketFanout counts each of its sockets"""
+        return sum(getattr(subscriber, 'connections', 1) for subscriber in list(self.subscribers))
+
+    def publish(self, event, data):
+        if not self.subscribers:
+            return  # Nobody listening, skip the encode
+        self.publish_frame(encode_event(event, data, data.get('version')))
+
+    def publish_frame(self, frame):
+        """Queue the same already-encoded bytes on every subscriber"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            if subscriber.closed:
+                self.unsubscribe(subscriber)
+            else:
+                subscriber.push(frame)
+
+    def close(self):
+        # Streams notice at their next frame or heartbeat and end
+        with self.lock:
+            self.closed = True
+            subscribers, self.subscribers = self.subscribers, []
+            if subscribers and self.on_active is not None:
+                self.on_active(False)
+        for subscriber in subscribers:
+            subscriber.closed = True
@@ -0,0 +1,316 @@
+import sys
+import json
+import uuid
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager
+from game_state import ThumbsUpGame
+from events import EventBroadcaster, encode_event
+from event_log import OP_CREATE_ROOM, OP_REMOVE_ROOM
+
+DEFAULT_ROOM = 'default'
+
+
+class RegistryFull(Exception):
+    """Raised instead of creating a room once the registry holds max_rooms"""
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate memory footprint of an object graph in bytes"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), seen)
+    return size
+
+
+class Command:
+    """One queued move: the callable, its outcome and a flag its caller waits on"""
+    __slots__ = ('function', 'args', 'result', 'error', 'done')
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = None  # Event, created only if the caller has to wait for another thread's drain
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class GameRoom:
+    def __init__(self, room_id, game=None):
+        self.room_id = room_id
+        self.game = game if game is not None else ThumbsUpGame()
+        self.journal = None  # EventLog recording this room's moves, if enabled
+        self.last_seq = 0  # Sequence number of the last logged move applied here
+        self.last_active = time.monotonic()  # Last state change, the reaper's idle clock
+        self.lock = threading.Lock()  # Serializes moves within this room only
+        self.commands = deque()  # Moves queued by execute(), applied in arrival order
+        self.commands_lock = threading.Lock()  # Guards commands and draining, held only to queue a move
+        self.draining = False  # True while some thread is applying the queued moves
+        self.batches = 0
+        self.commands_applied = 0
+        self.changed = threading.Condition(self.lock)
+        self.async_waiters = []  # [(loop, future)] parked by the asyncio server
+        self.broadcaster = EventBroadcaster(on_active=self.listen_for_events)
+        self.state_cache_version = None
+        self.state_cache = None  # (body when it is not your turn, body when it is)
+        self.spectators = EventBroadcaster()  # Read-only viewers, sent the whole state on every change
+        self.spectator_cache_version = None
+        self.spectator_cache = None
+        self.spectator_writer = None  # Thread mode: events.SocketFanout writing to this room's viewers
+
+    def listen_for_events(self, active):
+        # The game only builds event payloads while /events has subscribers. The list is
+        # replaced rather than changed in place, a move may be iterating it right now
+        publish = self.broadcaster.publish
+        listeners = [listener for listener in self.game.listeners if listener != publish]
+        self.game.listeners = listeners + [publish] if active else listeners
+
+    def encoded_state(self, is_my_turn):
+        """/game_state body, re-encoded only after the game has changed"""
+        # Caller must hold self.lock
+        if self.state_cache_version != self.game.version:
+            response_data = {'status': 'OK', 'room_id': self.room_id}
+            response_data.update(self.game.snapshot())
+            common = json.dumps(response_data)[:-1].encode()
+            self.state_cache = (common + b', "is_my_turn": false}', common + b', "is_my_turn": true}')
+            self.state_cache_version = self.game.version
+        return self.state_cache[is_my_turn]
+
+    def spectator_frame(self):
+        """/spectate state event, encoded once per version and shared by every viewer"""
+        # Caller must hold self.lock
+        if self.spectator_cache_version != self.game.version:
+            data = {'room_id': self.room_id}
+            data.update(self.game.snapshot())
+            self.spectator_cache = encode_event('state', data, self.game.version)
+            self.spectator_cache_version = self.game.version
+        return self.spectator_cache
+
+    @contextmanager
+    def mutate(self):
+        """Hold the room lock for a move and wake long-pollers if the state changed"""
+        with self.lock:
+            version = self.game.version
+            yield self.game
+            if self.game.version != version:
+                self.notify_changed()
+
+    def execute(self, function, *args):
+        """Run function(game, *args) as this room's next move and return its result.
+
+        Moves go through a per-room queue with a single consumer at a time: the
+        thread that finds the room idle applies everything queued, in order, under
+        one lock hold and one wake-up, while the others just wait for their result.
+        Every writer (requests, the reaper, the matchmaker) comes through here.
+
+        Moves only batch up when they arrive while another is being applied. With
+        moves as cheap as these that is rare under the GIL, so this is mostly a
+        serialized queue in front of the room lock, a few percent slower than
+        taking the lock directly (stress_game.py --mode lock).
+        """
+        command = Command(function, args)
+        with self.commands_lock:
+            self.commands.append(command)
+            consumer = not self.draining
+            if consumer:
+                self.draining = True
+            else:
+                command.done = threading.Event()
+        if consumer:
+            self.drain()
+        else:
+            command.done.wait()
+        if command.error is not None:
+            raise command.error
+        return command.result
+
+    def drain(self):
+        while True:
+            with self.commands_lock:
+                if not self.commands:
+                    self.draining = False
+                    return
+                batch, self.commands = self.commands, deque()
+            try:
+                with self.mutate() as game:
+                    for command in batch:
+                        try:
+                            command.result = command.function(game, *command.args)
+                        except Exception as e:
+                            command.error = e
+            finally:
+                self.batches += 1
+                self.commands_applied += len(batch)
+                for command in batch:
+                    if command.done is not None:
+                        command.done.set()
+
+    def apply(self, method, *args):
+        """Run a ThumbsUpGame move and journal it if it changed the game"""
+        # Caller must hold self.lock
+        version = self.game.version
+        result = getattr(self.game, method)(*args)
+        if self.game.version != version:
+            self.last_active = time.monotonic()
+            if self.journal is not None:
+                self.last_seq = self.journal.record_game_op(self.room_id, method, args)
+        return result
+
+    def notify_changed(self):
+        # Caller must hold self.lock
+        self.changed.notify_all()
+        if self.spectators.subscribers:
+            self.spectators.publish_frame(self.spectator_frame())
+        waiters, self.async_waiters = self.async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def wait_for_change(self, since, timeout):
+        # Caller must hold self.lock; the condition releases it while waiting
+        return self.changed.wait_for(lambda: self.game.version != since, timeout)
+
+    async def wait_for_change_async(self, since, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if self.game.version != since:
+                return True
+            self.async_waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            with self.lock:
+                if (loop, future) in self.async_waiters:
+                    self.async_waiters.remove((loop, future))
+            return False
+
+    def summary(self):
+        return {
+            'room_id': self.room_id,
+            'players': len(self.game.players),
+            'spectators': self.spectators.audience(),
+            'game_started': self.game.game_started,
+            'winner': self.game.winner
+        }
+
+    def memory_usage(self):
+        return deep_sizeof(self.game)
+
+
+class GameRegistry:
+    def __init__(self):
+        self.rooms = {}  # {room_id: GameRoom}
+        self.lock = threading.Lock()  # Guards the rooms dict, not the games
+        self.owns = None  # Set in cluster mode so generated ids land on this worker
+        self.journal = None
+        self.reaper = None  # lifecycle.Reaper told about every new room
+        self.max_rooms = None  # Per-process bound, None for unlimited
+
+    def attach_journal(self, journal):
+        self.journal = journal
+        for room in list(self.rooms.values()):
+            room.journal = journal
+
+    def attach_reaper(self, reaper):
+        self.reaper = reaper
+        for room in list(self.rooms.values()):
+            reaper.watch(room)
+
+    def new_room(self, room_id):
+        # Caller must hold self.lock
+        if self.max_rooms is not None and len(self.rooms) >= self.max_rooms:
+            raise RegistryFull('room limit of {} reached'.format(self.max_rooms))
+        room = GameRoom(room_id)
+        if self.journal is not None:
+            room.journal = self.journal
+            room.last_seq = self.journal.append(OP_CREATE_ROOM, room_id)
+        self.rooms[room_id] = room
+        if self.reaper is not None:
+            self.reaper.watch(room)
+        return room
+
+    def adopt_room(self, room):
+        """Add a room rebuilt outside the registry, e.g. by event log recovery"""
+        with self.lock:
+            self.rooms[room.room_id] = room
+        if self.reaper is not None:
+            self.reaper.watch(room)
+
+    def create_room(self, room_id=None):
+        with self.lock:
+            if room_id is None:
+                room_id = uuid.uuid4().hex[:8]
+                while room_id in self.rooms or (self.owns is not None and not self.owns(room_id)):
+                    room_id = uuid.uuid4().hex[:8]
+            elif room_id in self.rooms:
+                return None
+            return self.new_room(room_id)
+
+    def get_room(self, room_id):
+        return self.rooms.get(room_id)
+
+    def get_or_create_room(self, room_id):
+        room = self.rooms.get(room_id)
+        if room is not None:
+            return room
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                room = self.new_room(room_id)
+            return room
+
+    def remove_room(self, room_id):
+        with self.lock:
+            room = self.rooms.pop(room_id, None)
+            if room is not None and self.journal is not None:
+                self.journal.append(OP_REMOVE_ROOM, room_id)
+        if room is not None:
+            room.broadcaster.close()
+            room.spectators.close()
+        return room
+
+    def list_rooms(self):
+        return [room.summary() for room in list(self.rooms.values())]
+
+    def active_count(self):
+        return sum(1 for room in list(self.rooms.values()) if room.game.game_started and not room.game.winner)
+
+    def stats(self, per_room=False):
+        rooms = list(self.rooms.values())
+        memory = {room.room_id: room.memory_usage() for room in rooms}
+        total_memory = sum(memory.values())
+        stats = {
+            'room_count': len(rooms),
+            'active_rooms': sum(1 for room in rooms if room.game.game_started and not room.game.winner),
+            'finished_rooms': sum(1 for room in rooms if room.game.winner),
+            'player_count': sum(len(room.game.players) for room in rooms),
+            'spectator_count': sum(room.spectators.audience() for room in rooms),
+            'memory_bytes': total_memory,
+            'avg_room_bytes': total_memory // len(rooms) if rooms else 0
+        }
+        if per_room:
+            stats['room_memory'] = memory
+        return stats
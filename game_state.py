@@ -1,70 +1,163 @@
 class ThumbsUpGame:
+    # Rule knobs, override in a subclass to try variants (see simulator.py)
+    STARTING_THUMBS = 2
+    MAX_PLAYERS = 3
+    MIN_PLAYERS = 2
+
+    __slots__ = (
+        'players', 'seats', 'turn_index', 'current_bet', 'game_started', 'winner',
+        'pending', 'thumb_total', 'version', 'listeners'
+    )
+
     def __init__(self):
         self.players = {}  # {player_id: remaining_thumbs}
-        self.current_turn = None
+        self.seats = []  # Fixed seat order, the turn rotates through it
+        self.turn_index = None  # Index into seats of the current bettor
         self.current_bet = None
         self.game_started = False
         self.winner = None
-        self.submissions = []  # Track thumb submissions
-        self.waiting_for_players = []  # Track who hasn't submitted thumbs
-        
+        self.pending = set()  # Players who haven't submitted thumbs yet
+        self.thumb_total = 0  # Running total of thumbs raised this round
+        self.version = 0  # Bumped on every state change, used for long-polling
+        self.listeners = []  # Callables receiving (event, data) on every change
+
+    @property
+    def current_turn(self):
+        if self.turn_index is None:
+            return None
+        return self.seats[self.turn_index]
+
+    @property
+    def waiting_for_players(self):
+        # Seat order, same as the list this used to be
+        return [p for p in self.seats if p in self.pending]
+
+    def snapshot(self):
+        return {
+            'version': self.version,
+            'players': dict(self.players),
+            'current_turn': self.current_turn,
+            'current_bet': self.current_bet,
+            'winner': self.winner,
+            'waiting_for_players': self.waiting_for_players
+        }
+
+    def to_state(self):
+        """Plain tuple of every field, for snapshots"""
+        return (dict(self.players), list(self.seats), self.turn_index, self.current_bet,
+                self.game_started, self.winner, set(self.pending), self.thumb_total, self.version)
+
+    @classmethod
+    def from_state(cls, state):
+        game = cls()
+        (game.players, game.seats, game.turn_index, game.current_bet, game.game_started,
+         game.winner, game.pending, game.thumb_total, game.version) = state
+        return game
+
+    def emit(self, event, **data):
+        if not self.listeners:
+            return
+        data['type'] = event
+        data['version'] = self.version
+        data['state'] = self.snapshot()
+        for listener in self.listeners:
+            listener(event, data)
+
     def add_player(self, player_id):
-        if len(self.players) < 3 and player_id not in self.players:
-            self.players[player_id] = 2  # Start with 5 thumbs
-            if len(self.players) >= 2 and not self.game_started:
+        if len(self.players) < self.MAX_PLAYERS and player_id not in self.players:
+            self.players[player_id] = self.STARTING_THUMBS
+            self.seats.append(player_id)
+            self.version += 1
+            self.emit('player_joined', player=player_id)
+            if len(self.players) >= self.MIN_PLAYERS and not self.game_started:
                 self.start_game()
             return True
         return False
-    
+
     def start_game(self):
         self.game_started = True
-        self.current_turn = list(self.players.keys())[0]  # First player starts
-        
+        self.turn_index = 0  # First player starts
+        self.version += 1
+        self.emit('game_started', current_turn=self.current_turn)
+
     def submit_bet(self, player_id, bet, own_thumbs):
-        if player_id != self.current_turn:
-            return False
-            
+        if player_id != self.current_turn or self.current_bet is not None:
+            return False  # A second bet would throw away thumbs already submitted this round
+
         self.current_bet = {
             'player': player_id,
             'bet': bet,
             'own_thumbs': own_thumbs
         }
-        self.submissions = [{'player': player_id, 'thumbs': own_thumbs}]  # Reset submissions
-        self.waiting_for_players = [p for p in self.players if p != player_id]  # Others must submit
+        self.thumb_total = own_thumbs  # Reset submissions
+        self.pending = set(self.seats)  # Others must submit
+        self.pending.discard(player_id)
+        self.version += 1
+        self.emit('bet_placed', player=player_id, bet=bet)
         return True
-    
+
     def submit_thumbs(self, player_id, thumbs):
-        if player_id not in self.waiting_for_players:
+        if player_id not in self.pending:
             return False  # Already submitted or not their turn
-            
-        self.submissions.append({'player': player_id, 'thumbs': thumbs})
-        self.waiting_for_players.remove(player_id)
+
+        self.thumb_total += thumbs
+        self.pending.discard(player_id)
+        self.version += 1
+        self.emit('thumbs_submitted', player=player_id)
+        return True
+
+    def remove_player(self, player_id):
+        """Drop a player who stopped playing, the last one left in a started game wins"""
+        if player_id not in self.players:
+            return False
+        seat = self.seats.index(player_id)
+        del self.players[player_id]
+        self.seats.pop(seat)
+        self.pending.discard(player_id)
+        self.version += 1
+        if self.turn_index is not None:
+            if self.current_bet and self.current_bet['player'] == player_id:
+                # The round goes with its bettor
+                self.current_bet = None
+                self.pending = set()
+                self.thumb_total = 0
+            if seat < self.turn_index:
+                self.turn_index -= 1
+            if self.seats:
+                self.turn_index %= len(self.seats)  # A removed bettor's turn passes to the next seat
+        self.emit('player_left', player=player_id)
+        if self.game_started and self.winner is None and len(self.seats) == 1:
+            self.winner = self.seats[0]
+            self.version += 1  # Listeners drop events at a version they have already rendered
+            self.emit('winner', player=self.winner)
         return True
-    
+
     def all_thumbs_submitted(self):
-        return len(self.waiting_for_players) == 0
-    
+        return not self.pending
+
     def evaluate_round(self):
         if not self.current_bet or not self.all_thumbs_submitted():
             return False
-            
-        total_thumbs = sum(sub['thumbs'] for sub in self.submissions)
-        
-        if total_thumbs == self.current_bet['bet']:
+
+        total_thumbs = self.thumb_total
+        self.version += 1
+        betting_player = self.current_bet['player']
+        correct = total_thumbs == self.current_bet['bet']
+
+        if correct:
             # Correct bet - remove one thumb
-            betting_player = self.current_bet['player']
             self.players[betting_player] -= 1
-            
+
             # Check for winner
             if self.players[betting_player] <= 0:
                 self.winner = betting_player
+                self.emit('round_evaluated', player=betting_player, total_thumbs=total_thumbs, correct=True)
+                self.emit('winner', player=betting_player)
                 return True
-                
+
         # Move to next player
-        player_list = list(self.players.keys())
-        current_index = player_list.index(self.current_turn)
-        next_index = (current_index + 1) % len(player_list)
-        self.current_turn = player_list[next_index]
+        self.turn_index = (self.turn_index + 1) % len(self.seats)
         self.current_bet = None
-        self.submissions = []
+        self.thumb_total = 0
+        self.emit('round_evaluated', player=betting_player, total_thumbs=total_thumbs, correct=correct)
         return False
\ No newline at end of file
@@ -0,0 +1,89 @@
+import sys
+import json
+import time
+import random
+import threading
+from collections import deque
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+
+class GameLogger:
+    """Leveled, sampled logger; the request path only appends to a buffer, a thread writes JSON lines"""
+
+    def __init__(self, level=INFO, sample_rate=1.0, stream=None, flush_interval=0.5, max_buffer=10000):
+        self.level = level
+        self.sample_rate = sample_rate  # Fraction of sampled (high-volume) records kept
+        self.stream = stream
+        self.flush_interval = flush_interval
+        self.buffer = deque(maxlen=max_buffer)
+        self.dropped = 0
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def configure(self, level=None, sample_rate=None, stream=None):
+        if level is not None:
+            self.level = LEVELS[level] if isinstance(level, str) else level
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if stream is not None:
+            self.stream = stream
+
+    def log(self, level, message, sampled=False, **fields):
+        if level < self.level:
+            return
+        if sampled and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1  # The oldest record falls off the deque
+        # Formatting happens on the writer thread, not here
+        self.buffer.append((time.time(), level, message, fields))
+        if self.writer is None:
+            self.start()
+
+    def debug(self, message, sampled=False, **fields):
+        self.log(DEBUG, message, sampled, **fields)
+
+    def info(self, message, sampled=False, **fields):
+        self.log(INFO, message, sampled, **fields)
+
+    def warning(self, message, sampled=False, **fields):
+        self.log(WARNING, message, sampled, **fields)
+
+    def error(self, message, sampled=False, **fields):
+        self.log(ERROR, message, sampled, **fields)
+
+    def start(self):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.write_loop, daemon=True)
+                self.writer.start()
+
+    def write_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        lines = []
+        while self.buffer:
+            try:
+                ts, level, message, fields = self.buffer.popleft()
+            except IndexError:
+                break
+            record = {'ts': round(ts, 6), 'level': LEVEL_NAMES[level], 'msg': message}
+            record.update(fields)
+            lines.append(json.dumps(record, default=str))
+        if self.dropped:
+            lines.append(json.dumps({'ts': round(time.time(), 6), 'level': 'warning',
+                                     'msg': 'log records dropped', 'count': self.dropped}))
+            self.dropped = 0
+        if lines:
+            stream = self.stream or sys.stdout
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+
+
+log = GameLogger()
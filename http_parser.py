@@ -0,0 +1,109 @@
+def header(headers, name, default=''):
+    """Header value by case-insensitive name, from a parsed request or a plain dict"""
+    value = headers.get(name)
+    if value is not None:
+        return value
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return default
+
+
+class HttpParseError(Exception):
+    def __init__(self, kode, message):
+        super().__init__(message)
+        self.kode = kode
+        self.message = message
+
+
+class HttpRequest:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.target = target  # Path plus query string, as sent
+        self.version = version
+        self.headers = headers  # Names keep the case the client sent
+        self.body = body  # Raw bytes, json.loads() accepts them directly
+        self.path, _, self.query = target.partition('?')
+
+    def to_bytes(self):
+        """Re-serialize the request, used when handing a connection to another worker"""
+        lines = ['{} {} {}'.format(self.method, self.target, self.version)]
+        lines.extend('{}: {}'.format(key, value) for key, value in self.headers.items())
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + self.body
+
+    def header(self, name, default=''):
+        return header(self.headers, name, default)
+
+    @property
+    def keep_alive(self):
+        # HTTP/1.1 defaults to persistent connections, HTTP/1.0 must ask for them
+        connection = self.header('Connection').lower()
+        if self.version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+
+class HttpRequestParser:
+    """Incremental request parser, feed() it bytes as they arrive and pull complete requests"""
+
+    def __init__(self, max_header_size=8192, max_body_size=65536):
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.buffer = bytearray()
+        self.pending = None  # (method, target, version, headers, body_length) once the head is parsed
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_request(self):
+        """Return the next complete HttpRequest, or None until more bytes arrive"""
+        if self.pending is None:
+            header_end = self.buffer.find(b'\r\n\r\n')
+            if header_end == -1:
+                if len(self.buffer) > self.max_header_size:
+                    raise HttpParseError(431, 'Request Header Fields Too Large')
+                return None
+            if header_end > self.max_header_size:
+                raise HttpParseError(431, 'Request Header Fields Too Large')
+            # Only the head is decoded, the body stays bytes
+            head = bytes(self.buffer[:header_end]).decode('latin-1')
+            del self.buffer[:header_end + 4]
+            self.pending = self.parse_head(head)
+
+        method, target, version, headers, body_length = self.pending
+        if len(self.buffer) < body_length:
+            return None
+        body = bytes(self.buffer[:body_length])
+        del self.buffer[:body_length]
+        self.pending = None
+        return HttpRequest(method, target, version, headers, body)
+
+    def parse_head(self, head):
+        lines = head.split('\r\n')
+        j = lines[0].split(' ')
+        if len(j) != 3:
+            raise HttpParseError(400, 'Bad Request')
+        method, target, version = j
+        headers = {}
+        body_length = 0
+        for header_line in lines[1:]:
+            key, sep, value = header_line.partition(':')
+            if not sep:
+                continue
+            key = key.strip()
+            value = value.strip()
+            headers[key] = value
+            name = key.lower()
+            if name == 'content-length':
+                try:
+                    body_length = int(value)
+                except ValueError:
+                    raise HttpParseError(400, 'Bad Request')
+                if body_length < 0:
+                    raise HttpParseError(400, 'Bad Request')
+                if body_length > self.max_body_size:
+                    raise HttpParseError(413, 'Payload Too Large')
+            elif name == 'transfer-encoding' and value.lower() != 'identity':
+                raise HttpParseError(501, 'Not Implemented')
+        return method.upper(), target, version.upper(), headers, body_length
@@ -0,0 +1,189 @@
+import time
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+
+class SessionTable:
+    """Players seen recently, least recently seen first so expiry only ever looks at the front"""
+
+    def __init__(self, ttl=600, max_sessions=200000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()  # {player_id: (room_id, last_seen)}
+        self.lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0  # Dropped early to stay under max_sessions
+
+    def touch(self, player_id, room_id):
+        now = time.monotonic()
+        with self.lock:
+            self.sessions[player_id] = (room_id, now)
+            self.sessions.move_to_end(player_id)
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+
+    def get(self, player_id):
+        """(room_id, last_seen) or None"""
+        return self.sessions.get(player_id)
+
+    def expire(self, now):
+        with self.lock:
+            while self.sessions:
+                room_id, last_seen = next(iter(self.sessions.values()))
+                if now - last_seen < self.ttl:
+                    break
+                self.sessions.popitem(last=False)
+                self.expired += 1
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class Reaper:
+    """Evicts finished and abandoned rooms and times out stalled turns.
+
+    Each room has one entry in a deadline heap. When it comes due the room's
+    state decides what happens; a room that moved since is simply pushed back,
+    so nothing ever scans the whole registry.
+    """
+
+    def __init__(self, registry, sessions=None, turn_timeout=60, idle_timeout=600, finished_ttl=60,
+                 on_round_evaluated=None, metrics=None):
+        self.registry = registry
+        self.sessions = sessions
+        self.turn_timeout = turn_timeout  # Seconds a started game may wait on the same players
+        self.idle_timeout = idle_timeout  # Seconds a room may wait for its game to start
+        self.finished_ttl = finished_ttl  # Seconds a finished game stays readable
+        self.on_round_evaluated = on_round_evaluated
+        self.heap = []  # [(deadline, tiebreak, room_id)]
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.evicted = {'finished': 0, 'idle': 0}
+        self.players_timed_out = 0
+        self.rounds_forced = 0
+        self.evicted_counter = self.timed_out_counter = None
+        if metrics is not None:
+            self.evicted_counter = metrics.counter(
+                'game_rooms_evicted_total', 'Rooms removed by the reaper', ('reason',))
+            self.timed_out_counter = metrics.counter(
+                'game_players_timed_out_total', 'Players removed for stalling their game')
+            metrics.gauge('game_sessions', 'Players seen within the session TTL',
+                          function=lambda: len(self.sessions) if self.sessions is not None else 0)
+
+    def watch(self, room):
+        self.schedule(room.room_id, room.last_active + self.recheck_interval())
+        if self.thread is None:
+            self.start()
+
+    def schedule(self, room_id, deadline):
+        with self.lock:
+            heapq.heappush(self.heap, (deadline, next(self.counter), room_id))
+            earliest = self.heap[0][2] == room_id
+        if earliest:
+            self.wakeup.set()  # The reaper may be sleeping towards a later deadline
+
+    def recheck_interval(self):
+        # A room can switch to a shorter timeout (its game starts or ends) at any time,
+        # so no entry sleeps longer than the shortest one
+        return min(self.turn_timeout, self.finished_ttl, self.idle_timeout)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            now = time.monotonic()
+            if self.sessions is not None:
+                self.sessions.expire(now)
+            self.reap(now)
+            with self.lock:
+                delay = self.heap[0][0] - now if self.heap else 1.0
+            self.wakeup.wait(min(max(delay, 0.05), 1.0))
+            self.wakeup.clear()
+
+    def reap(self, now):
+        while True:
+            with self.lock:
+                if not self.heap or self.heap[0][0] > now:
+                    return
+                _, _, room_id = heapq.heappop(self.heap)
+            room = self.registry.get_room(room_id)
+            if room is None:
+                continue  # Removed some other way
+            deadline = self.check(room, now)
+            if deadline is not None:
+                self.schedule(room_id, min(deadline, now + self.recheck_interval()))
+
+    def due(self, room):
+        game = room.game
+        if game.winner is not None:
+            return room.last_active + self.finished_ttl, 'finished'
+        if game.game_started:
+            return room.last_active + self.turn_timeout, 'stalled'
+        return max(room.last_active, self.last_seen(room)) + self.idle_timeout, 'idle'
+
+    def last_seen(self, room):
+        # A player still polling a room that waits for opponents keeps it alive
+        latest = 0
+        if self.sessions is not None:
+            for player_id in list(room.game.players):
+                session = self.sessions.get(player_id)
+                if session is not None and session[0] == room.room_id:
+                    latest = max(latest, session[1])
+        return latest
+
+    def check(self, room, now):
+        """Act on a room whose entry came due, returns its next deadline or None once it is gone"""
+        deadline, reason = room.execute(self.settle, room, now)
+        if reason is None:
+            return deadline
+        self.registry.remove_room(room.room_id)
+        self.evicted[reason] += 1
+        if self.evicted_counter is not None:
+            self.evicted_counter.inc(reason)
+        return None
+
+    def settle(self, game, room, now):
+        # Runs as one of the room's moves: (next deadline, None), or (deadline, reason) to evict it
+        deadline, reason = self.due(room)
+        if deadline > now:
+            return deadline, None
+        if reason == 'stalled':
+            self.time_out_turn(room)
+            return self.due(room)[0], None
+        return deadline, reason
+
+    def time_out_turn(self, room):
+        # Caller must hold room.lock; removes whoever the game is waiting on
+        game = room.game
+        if game.current_bet is None:
+            stalled = [game.current_turn]
+        else:
+            stalled = game.waiting_for_players
+        for player_id in stalled:
+            if room.apply('remove_player', player_id):
+                self.players_timed_out += 1
+                if self.timed_out_counter is not None:
+                    self.timed_out_counter.inc()
+        if game.winner is None and game.current_bet and game.all_thumbs_submitted():
+            room.apply('evaluate_round')
+            self.rounds_forced += 1
+            if self.on_round_evaluated is not None:
+                self.on_round_evaluated()
+
+    def stats(self):
+        return {
+            'sessions': len(self.sessions) if self.sessions is not None else None,
+            'scheduled': len(self.heap),
+            'rooms_evicted': dict(self.evicted),
+            'players_timed_out': self.players_timed_out,
+            'rounds_forced': self.rounds_forced
+        }
@@ -0,0 +1,267 @@
+import time
+import asyncio
+import argparse
+import threading
+from collections import OrderedDict, deque
+from game_registry import RegistryFull, _resolve
+from game_state import ThumbsUpGame
+
+
+class Ticket:
+    __slots__ = ('player_id', 'queued_at', 'last_seen', 'waiting', 'room_id', 'players', 'matched_at',
+                 'event', 'async_waiters')
+
+    def __init__(self, player_id, now):
+        self.player_id = player_id
+        self.queued_at = now
+        self.last_seen = now  # Last time the player asked, tickets nobody asks about expire
+        self.waiting = 0  # Requests currently parked on this ticket
+        self.room_id = None  # Set once matched
+        self.players = None
+        self.matched_at = None
+        self.event = None  # Created by the first blocking wait, one per ticket so a match wakes only its players
+        self.async_waiters = []  # [(loop, future)] parked by the asyncio server
+
+
+class Matchmaker:
+    """Queue of players looking for a game, batched into 2-3 player rooms by a background thread"""
+
+    def __init__(self, registry, min_players=ThumbsUpGame.MIN_PLAYERS, max_players=ThumbsUpGame.MAX_PLAYERS,
+                 batch_window=0.25, ticket_ttl=60, metrics=None):
+        self.registry = registry
+        self.min_players = min_players
+        self.max_players = max_players
+        self.batch_window = batch_window  # Seconds the oldest player waits for a full game
+        self.ticket_ttl = ticket_ttl
+        self.queue = OrderedDict()  # {player_id: Ticket}, oldest first
+        self.results = {}  # {player_id: Ticket} matched but not yet told
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.matcher = None
+        self.games_formed = 0
+        self.players_matched = 0
+        self.expired = 0
+        self.recent_waits = deque(maxlen=1000)  # Seconds from queueing to match, for percentiles
+        self.games_counter = self.wait_histogram = None
+        if metrics is not None:
+            metrics.gauge('game_matchmaking_queue_depth', 'Players waiting for a match',
+                          function=lambda: len(self.queue))
+            self.games_counter = metrics.counter(
+                'game_matchmaking_games_total', 'Games formed by matchmaking', ('players',))
+            self.wait_histogram = metrics.histogram(
+                'game_matchmaking_wait_seconds', 'Time from queueing to landing in a game')
+
+    def enqueue(self, player_id):
+        """Ticket for the player, queueing them unless they are already queued or matched"""
+        now = time.monotonic()
+        with self.lock:
+            ticket = self.results.get(player_id) or self.queue.get(player_id)
+            if ticket is None:
+                ticket = self.queue[player_id] = Ticket(player_id, now)
+            ticket.last_seen = now
+            full = len(self.queue) >= self.max_players
+        if self.matcher is None:
+            self.start()
+        if full:
+            self.wakeup.set()
+        return ticket
+
+    def claim(self, ticket):
+        """Response data for the ticket, handing over the match if there is one"""
+        with self.lock:
+            ticket.last_seen = time.monotonic()
+            if ticket.room_id is None:
+                position = 0
+                for position, queued in enumerate(self.queue.values(), 1):
+                    if queued is ticket:
+                        break
+                return {'status': 'QUEUED', 'queue_depth': len(self.queue), 'position': position}
+            self.results.pop(ticket.player_id, None)
+        return {
+            'status': 'OK',
+            'room_id': ticket.room_id,
+            'players': ticket.players,
+            'waited_seconds': round(ticket.matched_at - ticket.queued_at, 4)
+        }
+
+    def wait(self, ticket, timeout):
+        with self.lock:
+            if ticket.room_id is not None:
+                return True
+            if ticket.event is None:
+                ticket.event = threading.Event()
+            ticket.waiting += 1
+        try:
+            return ticket.event.wait(timeout)
+        finally:
+            with self.lock:
+                ticket.waiting -= 1
+
+    async def wait_async(self, ticket, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if ticket.room_id is not None:
+                return True
+            ticket.waiting += 1
+            ticket.async_waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            with self.lock:
+                if (loop, future) in ticket.async_waiters:
+                    ticket.async_waiters.remove((loop, future))
+            return False
+        finally:
+            with self.lock:
+                ticket.waiting -= 1
+
+    def start(self):
+        with self.lock:
+            if self.matcher is None:
+                self.matcher = threading.Thread(target=self.match_loop, daemon=True)
+                self.matcher.start()
+
+    def match_loop(self):
+        while True:
+            self.wakeup.wait(self.batch_window / 2)
+            self.wakeup.clear()
+            self.form_games()
+
+    def batch_sizes(self, count):
+        # As few games as possible, sized evenly: 4 -> 2+2, 5 -> 3+2, 7 -> 3+2+2
+        groups = -(-count // self.max_players)
+        while groups and count // groups < self.min_players:
+            groups -= 1
+        if not groups:
+            return []
+        count = min(count, groups * self.max_players)
+        base, extra = divmod(count, groups)
+        return [base + 1] * extra + [base] * (groups - extra)
+
+    def form_games(self):
+        now = time.monotonic()
+        with self.lock:
+            self.expire(now)
+            if not self.queue:
+                return 0
+            oldest = next(iter(self.queue.values()))
+            if now - oldest.queued_at >= self.batch_window:
+                sizes = self.batch_sizes(len(self.queue))
+            else:
+                # Inside the window only games that cannot grow any more are formed, keeping back
+                # one more if the rest could not make a game on its own (7 -> 3 now, 4 kept for 2+2)
+                full, rest = divmod(len(self.queue), self.max_players)
+                if 0 < rest < self.min_players:
+                    full -= 1
+                sizes = [self.max_players] * max(full, 0)
+            groups = [[self.queue.popitem(last=False)[1] for _ in range(size)] for size in sizes]
+
+        # Rooms are created outside the queue lock, joins keep arriving meanwhile
+        for index, group in enumerate(groups):
+            try:
+                room = self.registry.create_room()
+            except RegistryFull:
+                # Put everyone not yet placed back at the front, they go again once rooms are freed
+                with self.lock:
+                    for ticket in reversed([ticket for left in groups[index:] for ticket in left]):
+                        self.queue[ticket.player_id] = ticket
+                        self.queue.move_to_end(ticket.player_id, last=False)
+                return index
+            room.execute(self.seat, room, group)
+            players = [ticket.player_id for ticket in group]
+            matched_at = time.monotonic()
+            with self.lock:
+                for ticket in group:
+                    ticket.room_id = room.room_id
+                    ticket.players = players
+                    ticket.matched_at = matched_at
+                    self.results[ticket.player_id] = ticket
+                    self.recent_waits.append(matched_at - ticket.queued_at)
+                    if ticket.event is not None:
+                        ticket.event.set()
+                    waiters, ticket.async_waiters = ticket.async_waiters, []
+                    for loop, future in waiters:
+                        loop.call_soon_threadsafe(_resolve, future)
+                self.games_formed += 1
+                self.players_matched += len(group)
+            if self.games_counter is not None:
+                self.games_counter.inc(len(group))
+                for ticket in group:
+                    self.wait_histogram.observe(matched_at - ticket.queued_at)
+        return len(groups)
+
+    def seat(self, game, room, group):
+        # Runs as one of the room's moves, like a /join
+        for ticket in group:
+            room.apply('add_player', ticket.player_id)
+
+    def expire(self, now):
+        # Caller must hold self.lock; drops players who stopped asking
+        for tickets in (self.queue, self.results):
+            stale = [player_id for player_id, ticket in tickets.items()
+                     if not ticket.waiting and now - ticket.last_seen > self.ticket_ttl]
+            for player_id in stale:
+                del tickets[player_id]
+            self.expired += len(stale)
+
+    def stats(self):
+        with self.lock:
+            waits = sorted(self.recent_waits)
+            oldest = next(iter(self.queue.values()), None)
+            queue_depth = len(self.queue)
+
+        def percentile(pct):
+            return round(waits[min(len(waits) - 1, int(len(waits) * pct))], 4) if waits else None
+
+        return {
+            'queue_depth': queue_depth,
+            'oldest_wait_seconds': round(time.monotonic() - oldest.queued_at, 4) if oldest else 0,
+            'games_formed': self.games_formed,
+            'players_matched': self.players_matched,
+            'expired_tickets': self.expired,
+            'time_to_match_p50': percentile(0.5),
+            'time_to_match_p99': percentile(0.99)
+        }
+
+
+def benchmark(joins, rate, batch_window):
+    """Feed joins at a fixed rate through an in-process matchmaker and report time to match"""
+    from game_registry import GameRegistry
+
+    matchmaker = Matchmaker(GameRegistry(), batch_window=batch_window)
+    done = threading.Semaphore(0)
+
+    def player(player_id):
+        ticket = matchmaker.enqueue(player_id)
+        matchmaker.wait(ticket, 30)
+        matchmaker.claim(ticket)
+        done.release()
+
+    start = time.perf_counter()
+    for index in range(joins):
+        # Pace the arrivals, sleeping only when ahead of schedule
+        delay = start + index / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        threading.Thread(target=player, args=('bot-{}'.format(index),), daemon=True).start()
+    # A lone straggler at the end never gets a game, stop once matches dry up
+    for _ in range(joins):
+        if not done.acquire(timeout=batch_window * 4 + 1):
+            break
+    elapsed = time.perf_counter() - start
+    stats = matchmaker.stats()
+    stats['joins_per_second'] = round(joins / elapsed)
+    stats['rooms'] = len(matchmaker.registry.rooms)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Matchmaking throughput and time-to-match benchmark')
+    parser.add_argument('--joins', type=int, default=20000)
+    parser.add_argument('--rate', type=int, default=5000, help='join requests per second')
+    parser.add_argument('--window', type=float, default=0.25, help='batching window in seconds')
+    args = parser.parse_args()
+    for key, value in benchmark(args.joins, args.rate, args.window).items():
+        print(f'{key}: {value}')
@@ -1,91 +1,435 @@
 import sys
 import os.path
+import argparse
 import uuid
 import json
 import socket
 import threading
 from glob import glob
+from urllib.parse import parse_qs
+import time
 from datetime import datetime
-from game_state import ThumbsUpGame
+from game_registry import GameRegistry, RegistryFull, DEFAULT_ROOM
+from matchmaking import Matchmaker
+from strategy import OddsTable
+from admission import TokenBucketLimiter, WorkerPool, retry_after
+from lifecycle import SessionTable, Reaper
+from events import ThreadSubscriber, SocketFanout, encode_event
+from http_parser import HttpRequestParser, HttpParseError, header
+from metrics import MetricsRegistry
+from gamelog import log
+
+class DateHeader:
+    """Date header line, formatted at most once per second"""
+
+    def __init__(self):
+        self.second = None
+        self.line = b''
+
+    def get(self):
+        now = int(time.time())
+        if now != self.second:
+            tanggal = datetime.fromtimestamp(now).strftime('%c')
+            self.line = "Date: {}\r\n".format(tanggal).encode()
+            self.second = now
+        return self.line
+
+date_header = DateHeader()
+
+STATUS_LINES = {
+    (kode, message): "HTTP/1.1 {} {}\r\n".format(kode, message).encode()
+    for kode, message in [
+        (200, 'OK'), (304, 'Not Modified'), (400, 'Bad Request'), (404, 'Not Found'),
+        (413, 'Payload Too Large'), (429, 'Too Many Requests'), (431, 'Request Header Fields Too Large'),
+        (501, 'Not Implemented'), (503, 'Service Unavailable')
+    ]
+}
+EVENT_STREAM_HEAD = (b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Connection: keep-alive\r\n"
+                     b"Server: gameserver/1.0\r\n\r\n")
+CLOSE_BLOCK = b"Connection: close\r\nServer: gameserver/1.0\r\n"
+JSON_CONTENT_TYPE = b"Content-type: application/json\r\n"
+ROUTES = {'/join', '/matchmake', '/game_state', '/submit_bet', '/submit_thumbs', '/events', '/spectate', '/rooms', '/stats', '/metrics', '/hint'}
 
 class GameHttpServer:
     def __init__(self):
-        self.sessions = {}
+        self.sessions = SessionTable()  # {player_id: (room_id, last seen)}, expired by the reaper
         self.types = {}
         self.types['.json'] = 'application/json'
         self.types['.txt'] = 'text/plain'
         self.types['.html'] = 'text/html'
-        self.game = ThumbsUpGame()
-        
-    def response(self, kode=404, message='Not Found', messagebody=bytes(), headers={}):
-        tanggal = datetime.now().strftime('%c')
-        resp = []
-        resp.append("HTTP/1.0 {} {}\r\n".format(kode, message))
-        resp.append("Date: {}\r\n".format(tanggal))
-        resp.append("Connection: close\r\n")
-        resp.append("Server: gameserver/1.0\r\n")
-        resp.append("Content-Length: {}\r\n".format(len(messagebody)))
-        for kk in headers:
-            resp.append("{}:{}\r\n".format(kk, headers[kk]))
-        resp.append("\r\n")
+        self.idle_timeout = 15  # Seconds an idle keep-alive connection stays open
+        self.max_keepalive_requests = 1000  # Requests served before closing a connection
+        self.long_poll_timeout = 25  # Seconds a /game_state?since= request may be held
+        self.long_poll_blocking = True  # The asyncio server parks polls itself instead
+        self.event_heartbeat = 15  # Seconds between keep-alive comments on /events
+        self.max_workers = 512  # Thread mode: connections served at once, each holds a worker until it closes
+        self.accept_queue = 1024  # Thread mode: accepted connections waiting for a worker before shedding
+        self.max_connections = 10000  # asyncio mode: open connections before shedding
+        self.pool = None
+        self.poll_limiter = TokenBucketLimiter(rate=5, burst=20)  # /game_state per Player-ID
+        self.keep_alive_block = (
+            "Connection: keep-alive\r\n"
+            "Keep-Alive: timeout={}, max={}\r\n"
+            "Server: gameserver/1.0\r\n"
+        ).format(self.idle_timeout, self.max_keepalive_requests).encode()
+        self.registry = GameRegistry()
+        self.registry.max_rooms = 50000  # New rooms are refused past this many
+        self.registry.create_room(DEFAULT_ROOM)
+        self.cluster = None  # ClusterNode when running as one of several workers
+        self.tracer = None  # tracing.Tracer once enable_tracing() is called, the request path checks only this
+        self.journal = None  # EventLog when --data-dir is given
+        self.durable_timeout = 5  # Seconds a move's response waits for its log fsync before going out anyway
+        self.init_metrics()
+        self.matchmaker = Matchmaker(self.registry, metrics=self.metrics)
+        self.odds = OddsTable()  # Built now so /hint never computes a distribution for the standard rules
+        self.reaper = Reaper(self.registry, self.sessions, on_round_evaluated=self.rounds_evaluated.inc,
+                             metrics=self.metrics)
+        self.registry.attach_reaper(self.reaper)
+
+    def init_metrics(self):
+        self.metrics = MetricsRegistry()
+        self.requests_total = self.metrics.counter(
+            'game_requests_total', 'HTTP requests handled', ('route', 'code'))
+        self.request_seconds = self.metrics.histogram(
+            'game_request_duration_seconds', 'Time spent routing a request', ('route',))
+        self.active_connections = self.metrics.gauge(
+            'game_active_connections', 'Open client connections')
+        self.metrics.gauge('game_rooms', 'Rooms in the registry',
+                           function=lambda: len(self.registry.rooms))
+        self.metrics.gauge('game_spectators', 'Open /spectate streams across all rooms',
+                           function=lambda: sum(room.spectators.audience()
+                                                for room in list(self.registry.rooms.values())))
+        self.metrics.gauge('game_active_games', 'Started games without a winner',
+                           function=self.registry.active_count)
+        self.rounds_evaluated = self.metrics.counter(
+            'game_rounds_evaluated_total', 'Rounds evaluated across all rooms')
+        self.parse_errors = self.metrics.counter(
+            'game_parse_errors_total', 'Requests rejected by the HTTP parser', ('code',))
+        self.shed = self.metrics.counter(
+            'game_shed_total', 'Connections and requests turned away under load', ('reason',))
+        self.metrics.gauge('game_pool_busy_workers', 'Worker threads serving a connection',
+                           function=lambda: self.pool.busy if self.pool else 0)
+        self.metrics.gauge('game_pool_queued_connections', 'Accepted connections waiting for a worker',
+                           function=lambda: self.pool.queue.qsize() if self.pool else 0)
 
-        response_headers = ''
-        for i in resp:
-            response_headers = "{}{}".format(response_headers, i)
+    def configure_limits(self, max_workers=None, accept_queue=None, max_connections=None,
+                         poll_rate=None, poll_burst=None, max_rooms=None, turn_timeout=None):
+        if max_workers is not None:
+            self.max_workers = max_workers
+        if accept_queue is not None:
+            self.accept_queue = accept_queue
+        if max_connections is not None:
+            self.max_connections = max_connections
+        if poll_rate is not None:
+            self.poll_limiter.rate = poll_rate
+        if poll_burst is not None:
+            self.poll_limiter.burst = poll_burst
+        if max_rooms is not None:
+            self.registry.max_rooms = max_rooms
+        if turn_timeout is not None:
+            self.reaper.turn_timeout = turn_timeout
         
+    def response(self, kode=404, message='Not Found', messagebody=bytes(), headers={}, keep_alive=False):
         # Convert messagebody to bytes if it's not already
         if (type(messagebody) is not bytes):
             messagebody = messagebody.encode()
 
-        response = response_headers.encode() + messagebody
+        status_line = STATUS_LINES.get((kode, message))
+        if status_line is None:
+            status_line = "HTTP/1.1 {} {}\r\n".format(kode, message).encode()
+        resp = [
+            status_line,
+            date_header.get(),
+            self.keep_alive_block if keep_alive else CLOSE_BLOCK,
+            b"Content-Length: %d\r\n" % len(messagebody)
+        ]
+        for kk in headers:
+            resp.append("{}:{}\r\n".format(kk, headers[kk]).encode())
+        resp.append(b"\r\n")
+        resp.append(messagebody)
+        return b''.join(resp)
+
+    def json_body_response(self, body, extra_headers=b'', keep_alive=False):
+        """Fast path for an already-encoded JSON body"""
+        return b''.join([
+            STATUS_LINES[(200, 'OK')],
+            date_header.get(),
+            self.keep_alive_block if keep_alive else CLOSE_BLOCK,
+            b"Content-Length: %d\r\n" % len(body),
+            JSON_CONTENT_TYPE,
+            extra_headers,
+            b"\r\n",
+            body
+        ])
+
+    def dispatch(self, request, keep_alive=False):
+        start = time.perf_counter()
+        if request.method == 'GET':
+            response = self.http_get(request.target, request.headers, keep_alive)
+        elif request.method == 'POST':
+            response = self.http_post(request.target, request.headers, request.body, keep_alive)
+        else:
+            response = self.response(400, 'Bad Request', '', {}, keep_alive)
+
+        room_id, route = self.resolve_room(request.path, request.headers)
+        player_id = request.header('Player-ID')
+        if player_id:
+            self.sessions.touch(player_id, room_id)
+        if route not in ROUTES:
+            route = 'other'
+        self.request_seconds.observe(time.perf_counter() - start, route)
+        self.requests_total.inc(route, response[9:12].decode())
         return response
 
-    def proses(self, data):
-        requests = data.split("\r\n")
-        baris = requests[0]
-        
-        # Parse headers
-        all_headers = {}
-        for header_line in requests[1:]:
-            if header_line == '':
-                break
-            if ':' in header_line:
-                key, value = header_line.split(':', 1)
-                all_headers[key.strip()] = value.strip()
-        
-        # Find request body for POST requests
-        request_body = ''
+    def enable_journal(self, directory, snapshot_every=100000):
+        """Recover rooms from the event log in directory, then log every move to it"""
+        from event_log import EventLog
+        self.journal = EventLog(directory, snapshot_every=snapshot_every)
+        replayed = self.journal.recover(self.registry)
+        self.journal.start(self.registry)
+        print(f'Recovered {len(self.registry.rooms)} rooms, replayed {replayed} events from {directory}')
+
+    def durable_watermark(self, request):
+        """Log sequence that must be on disk before this request's response is sent, 0 for none"""
+        if self.journal is None:
+            return 0
+        if request.method != 'POST' and self.resolve_room(request.path, request.headers)[1] not in ('/join', '/matchmake'):
+            return 0  # Reads change nothing
+        return self.journal.seq
+
+    def wait_durable(self, seq):
+        # Group commit: moves are only acknowledged once the commit thread has fsynced them
+        if seq and not self.journal.wait_durable(seq, self.durable_timeout):
+            log.error('event log fsync is late, acknowledging moves anyway', seq=seq)
+
+    def enable_tracing(self, sample_rate=1.0, profile_rate=0.0, slow_ms=100):
+        """Time request stages, profile a sample of requests; dumped by SIGUSR1 or GET /debug/trace"""
+        import signal
+        from tracing import Tracer
+        self.tracer = Tracer(self, sample_rate, profile_rate, slow_ms)
+        self.tracer.install()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, self.tracer.dump)
+
+    def overloaded_response(self, reason, seconds=1):
+        """503 sent instead of serving when the server is saturated"""
+        self.shed.inc(reason)
+        return self.response(503, 'Service Unavailable', '', {'Retry-After': retry_after(seconds)})
+
+    def admit(self, client_socket, client_address, initial=b''):
+        """Queue a connection for the worker pool, or turn it away at once if it could not be served soon"""
+        # Workers are held for a connection's whole life (keep-alive, long-polls), so once all
+        # of them are taken a queued connection could wait indefinitely: shed it instead
+        if self.pool.saturated():
+            reason = 'pool_busy'
+        elif self.pool.submit(client_socket, client_address, initial):
+            return
+        else:
+            reason = 'queue_full'
         try:
-            empty_line_index = requests.index('')
-            if empty_line_index < len(requests) - 1:
-                request_body = '\r\n'.join(requests[empty_line_index + 1:])
-        except ValueError:
+            client_socket.settimeout(1)
+            client_socket.sendall(self.overloaded_response(reason))
+        except OSError:
             pass
+        finally:
+            client_socket.close()
+
+    def rate_limited(self, request, client_address, keep_alive=False):
+        """429 response if this /game_state poll is over the player's budget, else None"""
+        if request.method != 'GET':
+            return None
+        if self.resolve_room(request.path, request.headers)[1] != '/game_state':
+            return None
+        key = request.header('Player-ID') or client_address[0]
+        delay = self.poll_limiter.acquire(key)
+        if not delay:
+            return None
+        self.shed.inc('rate_limited')
+        return self.response(429, 'Too Many Requests', '', {'Retry-After': retry_after(delay)}, keep_alive)
+
+    def join_cluster(self, node):
+        self.cluster = node
+        self.metrics.gauge('game_cluster_worker', 'Index of the worker that answered, metrics are per worker',
+                           ('worker', 'workers')).inc(str(node.index), str(node.ring.workers))
+        self.registry.owns = node.owns
+        if not node.owns(DEFAULT_ROOM):
+            self.registry.remove_room(DEFAULT_ROOM)
 
-        j = baris.split(" ")
+    def worker_info(self):
+        # /rooms and /stats only cover the answering worker's rooms, say which one it was
+        if self.cluster is None:
+            return {}
+        return {'worker': self.cluster.index, 'workers': self.cluster.ring.workers}
+
+    def owner_of(self, request):
+        """Index of the worker that must serve this request, None when it is this one"""
+        if self.cluster is None:
+            return None
+        return self.cluster.owner_of(request, self.resolve_room)
+
+    def requested_version(self, query, headers):
+        # Long-poll version from ?since=<version> or an If-None-Match ETag
+        since = parse_qs(query).get('since', [header(headers, 'If-None-Match').strip('"')])[0]
         try:
-            method = j[0].upper().strip()
-            if (method == 'GET'):
-                object_address = j[1].strip()
-                return self.http_get(object_address, all_headers)
-            if (method == 'POST'):
-                object_address = j[1].strip()
-                return self.http_post(object_address, all_headers, request_body)
-            else:
-                return self.response(400, 'Bad Request', '', {})
-        except IndexError:
-            return self.response(400, 'Bad Request', '', {})
+            return int(since)
+        except ValueError:
+            return None
+
+    def pending_long_poll(self, request):
+        """Return (room, since) if this request is a /game_state poll that would have to wait"""
+        if request.method != 'GET':
+            return None
+        room_id, object_address = self.resolve_room(request.path, request.headers)
+        if object_address != '/game_state':
+            return None
+        room = self.registry.get_room(room_id)
+        since = self.requested_version(request.query, request.headers)
+        if room is None or since is None or room.game.version != since:
+            return None
+        return room, since
+
+    def pending_matchmake(self, request):
+        """Return the ticket if this request is a /matchmake call that would have to wait"""
+        if request.method != 'GET':
+            return None
+        player_id = request.header('Player-ID')
+        if not player_id or self.resolve_room(request.path, request.headers)[1] != '/matchmake':
+            return None
+        ticket = self.matchmaker.enqueue(player_id)
+        return None if ticket.room_id is not None else ticket
+
+    def event_stream_room(self, request):
+        """Return (room, spectate) if this request opens its /events or /spectate stream"""
+        if request.method != 'GET':
+            return None
+        room_id, object_address = self.resolve_room(request.path, request.headers)
+        if object_address not in ('/events', '/spectate'):
+            return None
+        room = self.registry.get_room(room_id)
+        if room is None:
+            return None
+        return room, object_address == '/spectate'
+
+    def event_stream_start(self, room, spectate=False):
+        """Response head plus the current state so subscribers start from it"""
+        with room.lock:
+            if spectate:
+                return EVENT_STREAM_HEAD + room.spectator_frame()
+            snapshot = room.game.snapshot()
+        data = {'type': 'snapshot', 'version': snapshot['version'], 'state': snapshot}
+        return EVENT_STREAM_HEAD + encode_event('snapshot', data, snapshot['version'])
+
+    def stream_events(self, client_socket, room):
+        # /events in thread mode: the connection and its worker are dedicated to the stream
+        # until the client goes away (/spectate goes through spectate_detached instead)
+        broadcaster = room.broadcaster
+        subscriber = broadcaster.subscribe(ThreadSubscriber())
+        try:
+            client_socket.sendall(self.event_stream_start(room))
+            while not subscriber.closed:
+                client_socket.sendall(subscriber.next_frame(self.event_heartbeat))
+        except OSError:
+            pass
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    def spectate_detached(self, client_socket, room):
+        """Thread mode: give a /spectate connection to its room's writer thread, it holds no worker.
+        False if the room is already gone and the caller should close the connection"""
+        with room.lock:
+            writer = room.spectator_writer
+            if writer is None:
+                writer = room.spectator_writer = SocketFanout(self.event_heartbeat)
+                room.spectators.subscribe(writer)
+                writer.start()
+            # Queued under the lock, so the writer sends this before any later state
+            return writer.add(client_socket, EVENT_STREAM_HEAD + room.spectator_frame())
+
+    def resolve_room(self, object_address, headers):
+        # Room id comes from /rooms/<room_id>/<action> or the Room-ID header
+        parts = object_address.split('/')
+        if len(parts) >= 4 and parts[1] == 'rooms':
+            return parts[2], '/' + '/'.join(parts[3:])
+        return header(headers, 'Room-ID') or DEFAULT_ROOM, object_address
+
+    def json_response(self, response_data, keep_alive=False):
+        return self.json_body_response(json.dumps(response_data).encode(), keep_alive=keep_alive)
+
+    def room_not_found(self, room_id, keep_alive=False):
+        return self.json_response({'status': 'ERROR', 'message': f'Room {room_id} not found'}, keep_alive)
+
+    def server_full(self, keep_alive=False):
+        return self.json_response({'status': 'ERROR', 'message': 'Server full, try again later'}, keep_alive)
+
+    def bad_request(self, message, keep_alive=False):
+        body = json.dumps({'status': 'ERROR', 'message': message})
+        return self.response(400, 'Bad Request', body, {'Content-type': 'application/json'}, keep_alive)
+
+    def invalid_move(self, room, player_id, **values):
+        """Why a move's numbers can't be played, or None; checked before the move is queued"""
+        # Read without the lock: a player's thumbs only drop when their own bet is evaluated
+        remaining = room.game.players.get(player_id)
+        for name, value in values.items():
+            if type(value) is not int or value < 0:
+                return '{} must be a whole number of at least 0'.format(name)
+            if name != 'bet' and remaining is not None and value > remaining:
+                return '{} must be at most {}'.format(name, remaining)
+        return None
+
+    def http_get(self, object_address, headers, keep_alive=False):
+        player_id = header(headers, 'Player-ID')
+        object_address, _, query = object_address.partition('?')
+
+        if object_address == '/rooms':
+            response_data = {
+                'status': 'OK',
+                'rooms': self.registry.list_rooms(),
+                'room_count': len(self.registry.rooms)
+            }
+            response_data.update(self.worker_info())
+            return self.json_response(response_data, keep_alive)
+        if object_address == '/debug/trace' and self.tracer is not None:
+            report = self.tracer.report(reset='reset' in parse_qs(query))
+            return self.response(200, 'OK', report, {'Content-type': 'text/plain'}, keep_alive)
+        if object_address == '/metrics':
+            response_headers = {'Content-type': 'text/plain; version=0.0.4'}
+            return self.response(200, 'OK', self.metrics.render(), response_headers, keep_alive)
+        if object_address == '/stats':
+            response_data = {'status': 'OK'}
+            response_data.update(self.worker_info())
+            response_data.update(self.registry.stats(per_room=True))
+            response_data['matchmaking'] = self.matchmaker.stats()
+            response_data['lifecycle'] = self.reaper.stats()
+            response_data['odds_table'] = self.odds.stats()
+            return self.json_response(response_data, keep_alive)
+
+        room_id, object_address = self.resolve_room(object_address, headers)
+
+        if object_address == '/matchmake':
+            if not player_id:
+                return self.json_response({'status': 'ERROR', 'message': 'Player-ID required'}, keep_alive)
+            ticket = self.matchmaker.enqueue(player_id)
+            # Hold the request until the player lands in a game, like a long-poll
+            if self.long_poll_blocking:
+                self.matchmaker.wait(ticket, self.long_poll_timeout)
+            return self.json_response(self.matchmaker.claim(ticket), keep_alive)
 
-    def http_get(self, object_address, headers):
-        player_id = headers.get('Player-ID', '')
-        
         if object_address == '/join':
-            if self.game.add_player(player_id):
+            try:
+                room = self.registry.get_or_create_room(room_id)
+            except RegistryFull:
+                return self.server_full(keep_alive)
+            joined, game_started = room.execute(self.join_move, room, player_id)
+            if joined:
                 response_data = {
                     'status': 'OK',
                     'message': 'Joined game',
                     'player_id': player_id,
-                    'game_started': self.game.game_started
+                    'room_id': room_id,
+                    'game_started': game_started
                 }
             else:
                 response_data = {
@@ -93,118 +437,321 @@ class GameHttpServer:
                     'message': 'Game full or already joined'
                 }
                 
-        elif object_address == '/game_state':
+        elif object_address == '/hint':
+            room = self.registry.get_room(room_id)
+            if room is None:
+                return self.room_not_found(room_id, keep_alive)
+            with room.lock:
+                players = dict(room.game.players)
+            if player_id not in players:
+                return self.json_response({'status': 'ERROR', 'message': 'Not in this game'}, keep_alive)
+            # The bet is own_thumbs plus the likeliest total of the others, pass ?own_thumbs= once chosen
+            own_thumbs = parse_qs(query).get('own_thumbs', ['0'])[0]
+            if not own_thumbs.isdigit() or int(own_thumbs) > players[player_id]:
+                return self.json_response({'status': 'ERROR', 'message': 'Invalid own_thumbs'}, keep_alive)
+            bet, probability = self.odds.best_bet(players, player_id, int(own_thumbs))
             response_data = {
                 'status': 'OK',
-                'players': self.game.players,
-                'current_turn': self.game.current_turn,
-                'current_bet': self.game.current_bet,
-                'is_my_turn': player_id == self.game.current_turn,
-                'winner': self.game.winner,
-                'waiting_for_players': self.game.waiting_for_players
+                'bet': bet,
+                'own_thumbs': int(own_thumbs),
+                'probability': round(probability, 4)
             }
+
+        elif object_address == '/game_state':
+            room = self.registry.get_room(room_id)
+            if room is None:
+                return self.room_not_found(room_id, keep_alive)
+            since = self.requested_version(query, headers)
+            with room.lock:
+                # Hold the request until the state moves past the client's version
+                if since is not None and self.long_poll_blocking:
+                    room.wait_for_change(since, self.long_poll_timeout)
+                game = room.game
+                etag = '"{}"'.format(game.version)
+                if since == game.version:
+                    return self.response(304, 'Not Modified', '', {'ETag': etag}, keep_alive)
+                body = room.encoded_state(player_id == game.current_turn)
+            extra_headers = "ETag: {}\r\n".format(etag).encode()
+            return self.json_body_response(body, extra_headers, keep_alive)
         else:
             # Default 404 response
-            return self.response(404, 'Not Found', '', {})
+            return self.response(404, 'Not Found', '', {}, keep_alive)
         
         # Convert response to JSON and return
-        json_response = json.dumps(response_data)
-        response_headers = {'Content-type': 'application/json'}
-        return self.response(200, 'OK', json_response, response_headers)
+        return self.json_response(response_data, keep_alive)
+
+    # Moves run through GameRoom.execute(), one at a time per room, and build their response
+    # there so it describes the state the move left behind
 
-    def http_post(self, object_address, headers, request_body):
-        player_id = headers.get('Player-ID', '')
+    def join_move(self, game, room, player_id):
+        return room.apply('add_player', player_id), game.game_started
+
+    def bet_move(self, game, room, player_id, bet, own_thumbs):
+        if room.apply('submit_bet', player_id, bet, own_thumbs):
+            return {'status': 'OK'}
+        return {'status': 'ERROR', 'message': 'Not your turn'}
+
+    def thumbs_move(self, game, room, player_id, thumbs):
+        if not room.apply('submit_thumbs', player_id, thumbs):
+            return {'status': 'ERROR', 'message': 'Cannot submit thumbs'}
+        response_data = {'status': 'OK'}
+        # If all players submitted, evaluate the round
+        if game.all_thumbs_submitted():
+            round_result = room.apply('evaluate_round')
+            self.rounds_evaluated.inc()
+            if round_result:
+                response_data['game_over'] = True
+                response_data['winner'] = game.winner
+            else:
+                response_data['next_turn'] = game.current_turn
+        return response_data
+
+    def http_post(self, object_address, headers, request_body, keep_alive=False):
+        player_id = header(headers, 'Player-ID')
         
         try:
             post_data = json.loads(request_body) if request_body else {}
         except json.JSONDecodeError:
-            return self.response(400, 'Bad Request', 'Invalid JSON', {})
-        
+            return self.response(400, 'Bad Request', 'Invalid JSON', {}, keep_alive)
+        if not isinstance(post_data, dict):
+            return self.bad_request('Expected a JSON object', keep_alive)
+
+        if object_address == '/rooms':
+            room_id = post_data.get('room_id')
+            # Room ids end up in /rooms/<room_id>/... paths and the event log
+            if room_id is not None and (type(room_id) is not str or not room_id or '/' in room_id):
+                return self.bad_request("room_id must be a non-empty string without '/'", keep_alive)
+            try:
+                room = self.registry.create_room(room_id)
+            except RegistryFull:
+                return self.server_full(keep_alive)
+            if room is None:
+                return self.json_response({'status': 'ERROR', 'message': 'Room already exists'}, keep_alive)
+            return self.json_response({'status': 'OK', 'room_id': room.room_id}, keep_alive)
+
+        room_id, object_address = self.resolve_room(object_address, headers)
+        if object_address not in ('/submit_bet', '/submit_thumbs'):
+            return self.response(404, 'Not Found', '', {}, keep_alive)
+        room = self.registry.get_room(room_id)
+        if room is None:
+            return self.room_not_found(room_id, keep_alive)
         if object_address == '/submit_bet':
-            if self.game.submit_bet(player_id, post_data.get('bet'), post_data.get('own_thumbs')):
-                response_data = {'status': 'OK'}
-            else:
-                response_data = {'status': 'ERROR', 'message': 'Not your turn'}
-                
-        elif object_address == '/submit_thumbs':
-            success = self.game.submit_thumbs(player_id, post_data.get('thumbs'))
-            if success:
-                response_data = {'status': 'OK'}
-                
-                # If all players submitted, evaluate the round
-                if self.game.all_thumbs_submitted():
-                    round_result = self.game.evaluate_round()
-                    if round_result:
-                        response_data['game_over'] = True
-                        response_data['winner'] = self.game.winner
-                    else:
-                        response_data['next_turn'] = self.game.current_turn
-            else:
-                response_data = {'status': 'ERROR', 'message': 'Cannot submit thumbs'}
+            bet, own_thumbs = post_data.get('bet'), post_data.get('own_thumbs')
+            error = self.invalid_move(room, player_id, bet=bet, own_thumbs=own_thumbs)
+            if error:
+                return self.bad_request(error, keep_alive)
+            response_data = room.execute(self.bet_move, room, player_id, bet, own_thumbs)
         else:
-            return self.response(404, 'Not Found', '', {})
-        
+            thumbs = post_data.get('thumbs')
+            error = self.invalid_move(room, player_id, thumbs=thumbs)
+            if error:
+                return self.bad_request(error, keep_alive)
+            response_data = room.execute(self.thumbs_move, room, player_id, thumbs)
+
         # Convert response to JSON and return
-        json_response = json.dumps(response_data)
-        response_headers = {'Content-type': 'application/json'}
-        return self.response(200, 'OK', json_response, response_headers)
+        return self.json_response(response_data, keep_alive)
 
-    def run_server(self, host='localhost', port=55556):
+    def run_server(self, host='localhost', port=55556, backlog=1024, reuse_port=False):
         """Run the server to accept client connections"""
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Every worker of a cluster listens on the same port, the kernel spreads connections
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.pool = WorkerPool(self.handle_client, self.max_workers, self.accept_queue)
+        self.pool.start()
+        if self.cluster is not None:
+            self.cluster.serve_handoffs(self)
         
         try:
             server_socket.bind((host, port))
-            server_socket.listen(5)
+            server_socket.listen(backlog)
             print(f'Game server started on {host}:{port}')
             print('Waiting for connections...')
             
             while True:
                 client_socket, client_address = server_socket.accept()
-                print(f'Connection from {client_address}')
+                log.debug('connection opened', sampled=True, client=client_address)
                 
-                # Handle each client in a separate thread
-                client_thread = threading.Thread(
-                    target=self.handle_client, 
-                    args=(client_socket, client_address)
-                )
-                client_thread.daemon = True
-                client_thread.start()
+                # A pool worker serves the client, or it gets a 503 if every worker is taken or the queue is full
+                self.admit(client_socket, client_address)
                 
         except KeyboardInterrupt:
             print('\nShutting down server...')
         finally:
             server_socket.close()
+            log.flush()
     
-    def handle_client(self, client_socket, client_address):
+    def handle_client(self, client_socket, client_address, initial=b''):
         """Handle individual client connections"""
+        self.active_connections.inc()
+        client_socket.settimeout(self.idle_timeout)
+        parser = HttpRequestParser()
+        parser.feed(initial)  # Bytes already read by a worker that handed us the connection
+        served = 0
+        tracer = self.tracer
+        read_seconds = 0.0
+        detached = False  # Handed to a spectator writer, which closes it
         try:
             while True:
                 # Receive data from client
-                data = client_socket.recv(4096).decode('utf-8')
-                if not data:
+                if not initial:
+                    # Only waiting for the rest of a started request counts as read time, not idling
+                    partial = tracer is not None and parser.buffer
+                    if partial:
+                        started = time.perf_counter()
+                    try:
+                        data = client_socket.recv(65536)
+                    except socket.timeout:
+                        break
+                    if not data:
+                        break
+                    if partial:
+                        read_seconds += time.perf_counter() - started
+                    parser.feed(data)
+                initial = b''
+
+                # Answer every complete request in the buffer, in order (pipelining)
+                responses = []
+                traces = []
+                durable_seq = 0
+                keep_alive = True
+                try:
+                    while keep_alive:
+                        if tracer is not None:
+                            started = time.perf_counter()
+                        request = parser.next_request()
+                        if request is None:
+                            break
+                        if tracer is not None:
+                            trace = tracer.begin(request.target, read_seconds, time.perf_counter() - started)
+                            read_seconds = 0.0
+                            if trace is not None:
+                                traces.append(trace)
+                        served += 1
+                        # Connections are queued for a worker, give this one back after answering
+                        keep_alive = (request.keep_alive and served < self.max_keepalive_requests
+                                      and not self.pool.queue.qsize())
+                        log.debug('request', sampled=True, client=client_address,
+                                  method=request.method, target=request.target)
+
+                        # Another worker owns this room, let it take over the connection
+                        owner = self.owner_of(request)
+                        if owner is not None:
+                            client_socket.sendall(b''.join(responses))
+                            responses = []
+                            if self.cluster.hand_off(client_socket, owner, request.to_bytes() + bytes(parser.buffer)):
+                                return
+
+                        stream = self.event_stream_room(request)
+                        if stream is not None:
+                            client_socket.sendall(b''.join(responses))
+                            room, spectate = stream
+                            if spectate:
+                                detached = self.spectate_detached(client_socket, room)
+                            else:
+                                self.stream_events(client_socket, room)
+                            return
+
+                        # Process the HTTP request
+                        limited = self.rate_limited(request, client_address, keep_alive)
+                        responses.append(limited or self.dispatch(request, keep_alive))
+                        durable_seq = self.durable_watermark(request) or durable_seq
+                except HttpParseError as e:
+                    self.parse_errors.inc(e.kode)
+                    responses.append(self.response(e.kode, e.message, '', {}))
+                    keep_alive = False
+
+                # Send response back to client, once the moves it acknowledges are on disk
+                self.wait_durable(durable_seq)
+                if responses:
+                    started = time.perf_counter() if traces else 0
+                    client_socket.sendall(b''.join(responses))
+                    if traces:
+                        tracer.finish(traces, time.perf_counter() - started)
+                if not keep_alive:
                     break
                 
-                print(f'Received from {client_address}: {data[:100]}...')
-                
-                # Process the HTTP request
-                response = self.proses(data)
-                
-                # Send response back to client
-                client_socket.send(response)
-                
-                # Close connection after response (HTTP/1.0 behavior)
-                break
-                
         except Exception as e:
-            print(f'Error handling client {client_address}: {e}')
+            log.error('error handling client', client=client_address, error=repr(e))
         finally:
-            client_socket.close()
-            print(f'Connection with {client_address} closed')
+            if not detached:
+                client_socket.close()
+            self.active_connections.dec()
+            log.debug('connection closed', sampled=True, client=client_address)
+
+    def run_async_server(self, host='localhost', port=55556, backlog=1024, reuse_port=False):
+        """Run the server on an asyncio event loop instead of a thread per client"""
+        from async_server import AsyncGameServer
+        AsyncGameServer(self).run(host, port, backlog, reuse_port)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Thumbs Up game server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=55556)
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default='thread',
+                        help='thread: one thread per connection, asyncio: single event loop')
+    parser.add_argument('--backlog', type=int, default=1024, help='listen() backlog size')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='pre-fork this many worker processes sharing the port (SO_REUSEPORT); '
+                             '/rooms, /stats and /metrics then describe the answering worker, ?worker=N picks one')
+    parser.add_argument('--binary-port', type=int, default=None,
+                        help='also serve the compact binary protocol (binary_protocol.py) on this port')
+    parser.add_argument('--max-workers', type=int, default=512,
+                        help='thread mode and --binary-port: worker threads, one per open connection; '
+                             'new connections are shed while all of them are taken')
+    parser.add_argument('--accept-queue', type=int, default=1024,
+                        help='thread mode and --binary-port: connections waiting for a worker before '
+                             'they are shed')
+    parser.add_argument('--max-connections', type=int, default=10000,
+                        help='asyncio mode: open connections before 503s are sent')
+    parser.add_argument('--poll-rate', type=float, default=5, help='/game_state requests per second per player')
+    parser.add_argument('--poll-burst', type=int, default=20, help='/game_state burst allowance per player')
+    parser.add_argument('--max-rooms', type=int, default=50000, help='rooms held before new ones are refused')
+    parser.add_argument('--turn-timeout', type=float, default=60,
+                        help='seconds a started game waits on a player before removing them')
+    parser.add_argument('--data-dir', default=None,
+                        help='keep an event log and snapshots here and recover from them on start')
+    parser.add_argument('--snapshot-every', type=int, default=100000,
+                        help='logged moves between snapshots')
+    parser.add_argument('--trace', type=float, default=None, metavar='FRACTION',
+                        help='time read/parse/game/encode/send stages for this fraction of requests, '
+                             'report on SIGUSR1 or GET /debug/trace')
+    parser.add_argument('--profile-sample', type=float, default=0.0, metavar='FRACTION',
+                        help='with --trace, also run this fraction of requests under cProfile')
+    parser.add_argument('--slow-ms', type=float, default=100, help='with --trace, requests kept as slow')
+    parser.add_argument('--log-level', choices=['debug', 'info', 'warning', 'error'], default='info')
+    parser.add_argument('--log-sample', type=float, default=0.01,
+                        help='fraction of per-request debug records kept')
+    args = parser.parse_args()
+    log.configure(level=args.log_level, sample_rate=args.log_sample)
+    limits = {'max_workers': args.max_workers, 'accept_queue': args.accept_queue,
+              'max_connections': args.max_connections, 'poll_rate': args.poll_rate, 'poll_burst': args.poll_burst,
+              'max_rooms': args.max_rooms, 'turn_timeout': args.turn_timeout}
+    tracing = None
+    if args.trace is not None:
+        tracing = {'sample_rate': args.trace, 'profile_rate': args.profile_sample, 'slow_ms': args.slow_ms}
+
+    if args.workers > 1:
+        if args.binary_port:
+            parser.error('--binary-port cannot be combined with --workers, connections are not handed off')
+        from cluster import run_cluster
+        run_cluster(args.workers, host=args.host, port=args.port, backlog=args.backlog, mode=args.mode,
+                    data_dir=args.data_dir, snapshot_every=args.snapshot_every, limits=limits, tracing=tracing)
+        sys.exit(0)
+
     gameserver = GameHttpServer()
+    gameserver.configure_limits(**limits)
+    if args.data_dir:
+        gameserver.enable_journal(args.data_dir, args.snapshot_every)
+    if tracing:
+        gameserver.enable_tracing(**tracing)
+    if args.binary_port:
+        from binary_protocol import BinaryGameServer
+        BinaryGameServer(gameserver).start(args.host, args.binary_port, args.backlog)
     
     # Run the server
-    gameserver.run_server(host='0.0.0.0', port=55556)
\ No newline at end of file
+    if args.mode == 'asyncio':
+        gameserver.run_async_server(host=args.host, port=args.port, backlog=args.backlog)
+    else:
+        gameserver.run_server(host=args.host, port=args.port, backlog=args.backlog)
\ No newline at end of file
@@ -0,0 +1,168 @@
+import time
+import argparse
+import numpy as np
+from game_state import ThumbsUpGame
+
+# Strategies get (rng, thumbs, turn) for the games still running, where thumbs is a
+# (games, players) array of remaining thumbs and turn the bettor's seat per game, and
+# return (bets, raised): bets is (games,) and raised is (games, players) thumbs shown
+# this round. Bots only raise as many thumbs as they have left.
+
+
+def random_strategy(rng, thumbs, turn):
+    raised = rng.integers(0, thumbs + 1)
+    bets = rng.integers(0, thumbs.sum(axis=1) + 1)
+    return bets, raised
+
+
+def expected_value_strategy(rng, thumbs, turn):
+    # Raise at random, bet own raise plus the expected raise of everyone else
+    games = np.arange(len(thumbs))
+    raised = rng.integers(0, thumbs + 1)
+    own = raised[games, turn]
+    others = thumbs.sum(axis=1) - thumbs[games, turn]
+    bets = own + np.rint(others / 2).astype(thumbs.dtype)
+    return bets, raised
+
+
+STRATEGIES = {
+    'random': random_strategy,
+    'expected': expected_value_strategy
+}
+
+
+class BatchSimulator:
+    """Play many ThumbsUpGame matches at once, one array row per game"""
+
+    def __init__(self, n_games, n_players=3, starting_thumbs=ThumbsUpGame.STARTING_THUMBS,
+                 strategy=random_strategy, max_rounds=1000, seed=None):
+        self.n_games = n_games
+        self.n_players = n_players
+        self.starting_thumbs = starting_thumbs
+        self.strategy = strategy
+        self.max_rounds = max_rounds
+        self.rng = np.random.default_rng(seed)
+
+    def run(self, record=0):
+        """Simulate every game to the end, recording the moves of the first `record` games"""
+        thumbs = np.full((self.n_games, self.n_players), self.starting_thumbs, dtype=np.int16)
+        turn = np.zeros(self.n_games, dtype=np.int64)
+        rounds = np.zeros(self.n_games, dtype=np.int32)
+        winner = np.full(self.n_games, -1, dtype=np.int64)
+        live = np.arange(self.n_games)  # Indexes of games still running
+        record = min(record, self.n_games)
+        moves = []
+
+        for _ in range(self.max_rounds):
+            if not len(live):
+                break
+            seat = turn[live]
+            bets, raised = self.strategy(self.rng, thumbs[live], seat)
+            if record:
+                moves.append(self.record_moves(record, live, bets, raised))
+
+            # Vectorized evaluate_round: a correct bet costs the bettor one thumb
+            hit = raised.sum(axis=1) == bets
+            thumbs[live[hit], seat[hit]] -= 1
+            won = hit & (thumbs[live, seat] <= 0)
+            winner[live[won]] = seat[won]
+            rounds[live] += 1
+
+            # Finished games drop out, the turn passes to the next seat everywhere else
+            live = live[~won]
+            turn[live] = (seat[~won] + 1) % self.n_players
+
+        return {
+            'winner': winner,
+            'rounds': rounds,
+            'thumbs': thumbs,
+            'moves': moves
+        }
+
+    def record_moves(self, record, live, bets, raised):
+        # live is sorted, so the sampled games are a prefix of it
+        count = np.searchsorted(live, record)
+        active = np.zeros(record, dtype=bool)
+        sample_bets = np.zeros(record, dtype=bets.dtype)
+        sample_raised = np.zeros((record, self.n_players), dtype=raised.dtype)
+        sampled = live[:count]
+        active[sampled] = True
+        sample_bets[sampled] = bets[:count]
+        sample_raised[sampled] = raised[:count]
+        return active, sample_bets, sample_raised
+
+    def check_parity(self, result, sample):
+        """Replay the recorded moves through ThumbsUpGame, return the game indexes that disagree"""
+        rules = type('SimulatedGame', (ThumbsUpGame,), {
+            '__slots__': (),
+            'STARTING_THUMBS': self.starting_thumbs,
+            'MAX_PLAYERS': max(self.n_players, ThumbsUpGame.MAX_PLAYERS)
+        })
+        seats = ['p{}'.format(i) for i in range(self.n_players)]
+        mismatches = []
+
+        for g in range(min(sample, self.n_games)):
+            game = rules()
+            for player_id in seats:
+                game.add_player(player_id)
+            rounds = 0
+            for active, bets, raised in result['moves']:
+                if not active[g]:
+                    break
+                bettor = game.turn_index
+                game.submit_bet(seats[bettor], int(bets[g]), int(raised[g, bettor]))
+                for seat, player_id in enumerate(seats):
+                    if seat != bettor:
+                        game.submit_thumbs(player_id, int(raised[g, seat]))
+                game.evaluate_round()
+                rounds += 1
+
+            expected_winner = seats[result['winner'][g]] if result['winner'][g] >= 0 else None
+            expected_thumbs = [int(t) for t in result['thumbs'][g]]
+            if (game.winner != expected_winner or rounds != result['rounds'][g]
+                    or [game.players[p] for p in seats] != expected_thumbs):
+                mismatches.append(g)
+        return mismatches
+
+
+def summarize(result, elapsed):
+    winner = result['winner']
+    finished = winner >= 0
+    n_players = result['thumbs'].shape[1]
+    return {
+        'games': len(winner),
+        'finished': int(finished.sum()),
+        'mean_rounds': float(result['rounds'][finished].mean()) if finished.any() else 0.0,
+        'max_rounds': int(result['rounds'].max()),
+        'seat_win_rate': [float((winner == seat).mean()) for seat in range(n_players)],
+        'games_per_second': len(winner) / elapsed if elapsed else 0.0
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch simulator for Thumbs Up rules')
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=3)
+    parser.add_argument('--thumbs', type=int, default=ThumbsUpGame.STARTING_THUMBS,
+                        help='starting thumbs per player')
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='random')
+    parser.add_argument('--max-rounds', type=int, default=1000)
+    parser.add_argument('--parity', type=int, default=1000,
+                        help='number of games to cross-check against ThumbsUpGame')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    simulator = BatchSimulator(args.games, args.players, args.thumbs,
+                               STRATEGIES[args.strategy], args.max_rounds, args.seed)
+    start = time.perf_counter()
+    result = simulator.run(record=args.parity)
+    elapsed = time.perf_counter() - start
+
+    for key, value in summarize(result, elapsed).items():
+        print(f'{key}: {value}')
+    sample = min(args.parity, args.games)
+    if sample:
+        mismatches = simulator.check_parity(result, sample)
+        print(f'parity: {sample - len(mismatches)}/{sample} games match ThumbsUpGame')
+        if mismatches:
+            print(f'mismatching games: {mismatches[:20]}')
@@ -0,0 +1,130 @@
+import time
+import argparse
+from collections import OrderedDict
+from game_state import ThumbsUpGame
+
+# Opponents are modelled as raising uniformly at random between none and all of their
+# remaining thumbs, like the random bots. The bettor knows their own raise, so the best bet
+# is own_thumbs plus the most likely total of everyone else, whatever own_thumbs is.
+
+
+def total_distribution(opponents):
+    """P(total raised = n) for n = 0..sum(opponents), opponents being their remaining thumbs"""
+    distribution = [1.0]
+    for thumbs in opponents:
+        share = 1.0 / (thumbs + 1)
+        widened = [0.0] * (len(distribution) + thumbs)
+        for total, probability in enumerate(distribution):
+            for raised in range(thumbs + 1):
+                widened[total + raised] += probability * share
+        distribution = widened
+    return distribution
+
+
+class Odds:
+    __slots__ = ('best_total', 'probability', 'distribution')
+
+    def __init__(self, distribution):
+        self.distribution = tuple(distribution)
+        # Ties go to the smaller total
+        self.best_total = max(range(len(distribution)), key=distribution.__getitem__)
+        self.probability = distribution[self.best_total]
+
+
+class OddsTable:
+    """Outcome distributions keyed by the opponents' remaining thumbs, sorted.
+
+    Every configuration reachable under the standard rules is computed up front; anything
+    else (rule variants, bigger tables) is computed on first use and kept in an LRU of
+    max_entries, so a lookup is a tuple sort and a dict hit.
+    """
+
+    def __init__(self, max_players=ThumbsUpGame.MAX_PLAYERS, max_thumbs=ThumbsUpGame.STARTING_THUMBS,
+                 max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # {sorted opponents' thumbs: Odds}
+        self.hits = 0
+        self.misses = 0
+        self.precompute(max_players, max_thumbs)
+
+    def precompute(self, max_players, max_thumbs):
+        # Opponents still in the game have 1..max_thumbs each, one to max_players - 1 of them
+        configurations = [()]
+        for _ in range(max_players - 1):
+            configurations = [config + (thumbs,) for config in configurations
+                              for thumbs in range(config[-1] if config else 1, max_thumbs + 1)]
+            for config in configurations:
+                if len(self.entries) >= self.max_entries:
+                    return
+                self.entries[config] = Odds(total_distribution(config))
+
+    def lookup(self, opponents):
+        key = tuple(sorted(opponents))
+        odds = self.entries.get(key)
+        if odds is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return odds
+        self.misses += 1
+        odds = self.entries[key] = Odds(total_distribution(key))
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return odds
+
+    def best_bet(self, players, player_id, own_thumbs):
+        """(bet, probability the bet is right) for player_id betting after raising own_thumbs"""
+        odds = self.lookup([thumbs for other, thumbs in players.items() if other != player_id])
+        return own_thumbs + odds.best_total, odds.probability
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def benchmark(lookups, max_players, max_thumbs):
+    """Per-lookup latency of precomputed entries against computing each distribution"""
+    table = OddsTable(max_players, max_thumbs)
+    configs = list(table.entries)
+    players = [dict(('p{}'.format(seat), thumbs) for seat, thumbs in enumerate((1,) + config))
+               for config in configs]
+
+    start = time.perf_counter()
+    for index in range(lookups):
+        table.best_bet(players[index % len(players)], 'p0', 1)
+    cached = time.perf_counter() - start
+
+    uncached_lookups = max(1, lookups // 100)
+    start = time.perf_counter()
+    for index in range(uncached_lookups):
+        total_distribution(configs[index % len(configs)])
+    uncached = time.perf_counter() - start
+
+    # The whole /hint handler in process: routing, the room lock, the lookup and the JSON
+    from server import GameHttpServer
+    gameserver = GameHttpServer()
+    headers = {'Room-ID': 'hint-benchmark', 'Player-ID': 'p0'}
+    for player_id in ('p0', 'p1', 'p2'):
+        gameserver.http_get('/join', dict(headers, **{'Player-ID': player_id}))
+    handler_calls = max(1, lookups // 10)
+    start = time.perf_counter()
+    for _ in range(handler_calls):
+        gameserver.http_get('/hint?own_thumbs=1', headers, True)
+    handler = time.perf_counter() - start
+
+    return {
+        'configurations': len(configs),
+        'lookup_ns': round(cached / lookups * 1e9),
+        'compute_ns': round(uncached / uncached_lookups * 1e9),
+        'hint_handler_us': round(handler / handler_calls * 1e6, 2),
+        'hit_rate': round(table.hits / (table.hits + table.misses), 4)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Odds table lookup latency')
+    parser.add_argument('--lookups', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=ThumbsUpGame.MAX_PLAYERS)
+    parser.add_argument('--thumbs', type=int, default=ThumbsUpGame.STARTING_THUMBS,
+                        help='starting thumbs per player')
+    args = parser.parse_args()
+    for key, value in benchmark(args.lookups, args.players, args.thumbs).items():
+        print(f'{key}: {value}')
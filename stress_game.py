@@ -0,0 +1,151 @@
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from game_state import ThumbsUpGame
+from game_registry import GameRoom
+from server import GameHttpServer
+
+PLAYERS = ('p0', 'p1', 'p2')
+
+
+class EndlessGame(ThumbsUpGame):
+    # Nobody runs out of thumbs, so the one game can be hammered for as long as we like
+    STARTING_THUMBS = 10 ** 9
+
+
+def locked_execute(room, function, *args):
+    """The old path for comparison: every request takes the room lock for its own move"""
+    with room.mutate() as game:
+        return function(game, *args)
+
+
+class Hammer:
+    """Many threads per seat firing moves at one room through the HTTP handlers, in process"""
+
+    def __init__(self, threads, seed=None):
+        self.gameserver = GameHttpServer()
+        self.gameserver.long_poll_timeout = 0.2  # Lets threads notice the end of the run
+        self.room = GameRoom('stress', EndlessGame())
+        self.gameserver.registry.rooms[self.room.room_id] = self.room
+        self.headers = [{'Room-ID': self.room.room_id, 'Player-ID': player_id} for player_id in PLAYERS]
+        self.threads = threads
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.accepted_bets = 0
+        self.raised = 0  # Thumbs in accepted bets and /submit_thumbs calls
+        self.reported_rounds = 0  # Responses that announced a round result
+        self.rounds = []  # (total thumbs, correct) per round_evaluated event
+        self.versions = []
+        self.room.game.listeners.append(self.on_event)
+        for headers in self.headers:
+            self.gameserver.http_get('/join', headers)
+
+    def on_event(self, event, data):
+        # Runs under the room lock, in the order moves were applied
+        self.versions.append(data['version'])
+        if event == 'round_evaluated':
+            self.rounds.append((data['total_thumbs'], data['correct']))
+
+    def post(self, path, headers, body):
+        response = self.gameserver.http_post(path, headers, json.dumps(body))
+        return json.loads(response.partition(b'\r\n\r\n')[2])
+
+    def player(self, seat, stop, rng):
+        headers = self.headers[seat]
+        game = self.room.game
+        requests = bets = raised = rounds = 0
+        while not stop.is_set():
+            # Every thread of a seat wakes on the same change and fires the same move,
+            # read without the lock on purpose: all but one must be rejected
+            version = game.version
+            if game.current_turn == PLAYERS[seat] and game.current_bet is None:
+                own_thumbs = rng.randint(0, 2)
+                result = self.post('/submit_bet', headers, {'bet': rng.randint(0, 4), 'own_thumbs': own_thumbs})
+                if result['status'] == 'OK':
+                    bets += 1
+                    raised += own_thumbs
+                requests += 1
+            elif PLAYERS[seat] in game.pending:
+                thumbs = rng.randint(0, 2)
+                result = self.post('/submit_thumbs', headers, {'thumbs': thumbs})
+                if result['status'] == 'OK':
+                    raised += thumbs
+                    rounds += 'next_turn' in result or 'game_over' in result
+                requests += 1
+            # Long-poll like a real client until the game moves on
+            self.gameserver.http_get('/game_state?since={}'.format(version), headers)
+            requests += 1
+        with self.lock:
+            self.requests += requests
+            self.accepted_bets += bets
+            self.raised += raised
+            self.reported_rounds += rounds
+
+    def run(self, seconds):
+        stop = threading.Event()
+        workers = []
+        for index in range(self.threads):
+            rng = random.Random(None if self.seed is None else self.seed + index)
+            workers.append(threading.Thread(target=self.player, args=(index % len(PLAYERS), stop, rng)))
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        time.sleep(seconds)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - start
+
+    def check(self):
+        """Broken invariants, empty when every round was played out exactly once"""
+        game = self.room.game
+        open_round = game.current_bet is not None
+        errors = []
+        if len(self.rounds) != self.reported_rounds:
+            errors.append(f'{len(self.rounds)} rounds evaluated, {self.reported_rounds} reported to players')
+        metric = sum(self.gameserver.rounds_evaluated.values.values())
+        if metric != len(self.rounds):
+            errors.append(f'game_rounds_evaluated_total is {metric} for {len(self.rounds)} rounds')
+        if self.accepted_bets != len(self.rounds) + open_round:
+            errors.append(f'{self.accepted_bets} bets accepted for {len(self.rounds)} rounds')
+        counted = sum(total for total, _ in self.rounds) + (game.thumb_total if open_round else 0)
+        if counted != self.raised:
+            errors.append(f'rounds counted {counted} thumbs, players raised {self.raised}')
+        correct = sum(correct for _, correct in self.rounds)
+        lost = sum(EndlessGame.STARTING_THUMBS - thumbs for thumbs in game.players.values())
+        if lost != correct:
+            errors.append(f'{lost} thumbs taken away for {correct} correct bets')
+        if any(later < earlier for earlier, later in zip(self.versions, self.versions[1:])):
+            errors.append('events were emitted out of version order')
+        return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hammer one game from many threads and check it stays consistent')
+    parser.add_argument('--threads', type=int, default=48, help='threads, spread over the three seats')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--mode', choices=['queue', 'lock'], default='queue',
+                        help='queue: moves go through GameRoom.execute, lock: each request locks the room itself')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.mode == 'lock':
+        GameRoom.execute = locked_execute
+    hammer = Hammer(args.threads, args.seed)
+    elapsed = hammer.run(args.seconds)
+    room = hammer.room
+    print(f'mode: {args.mode}')
+    print(f'requests: {hammer.requests} ({hammer.requests / elapsed:.0f}/s)')
+    print(f'rounds: {len(hammer.rounds)} ({len(hammer.rounds) / elapsed:.0f}/s)')
+    print(f'moves applied: {room.game.version}')
+    if room.batches:
+        print(f'average batch: {room.commands_applied / room.batches:.1f} moves per lock hold')
+    errors = hammer.check()
+    for error in errors:
+        print(f'INCONSISTENT: {error}')
+    print('consistent' if not errors else f'{len(errors)} invariants broken')
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,187 @@
+import io
+import sys
+import time
+import random
+import pstats
+import cProfile
+import threading
+from collections import deque
+from game_registry import GameRoom
+from matchmaking import Matchmaker
+
+STAGES = ('read', 'parse', 'wait', 'game', 'encode', 'send', 'other')
+
+
+class RequestTrace:
+    """Seconds spent in each stage of one request"""
+    __slots__ = ('target', 'started', 'spans', 'depth')
+
+    def __init__(self, target, read_seconds, parse_seconds):
+        self.target = target
+        self.started = time.perf_counter() - parse_seconds
+        self.spans = {'read': read_seconds, 'parse': parse_seconds}
+        self.depth = 0  # Set while a timed call runs, nested timed calls count towards the outer one
+
+    def add(self, stage, seconds):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+
+class Tracer:
+    """Opt-in stage timings and sampled cProfile runs for the request path.
+
+    Nothing here runs unless GameHttpServer.enable_tracing() was called: the connection
+    loops only check `tracer is not None`, and the deeper stages are timed by wrappers
+    that install() swaps in and uninstall() takes out again.
+    """
+
+    def __init__(self, gameserver, sample_rate=1.0, profile_rate=0.0, slow_ms=100, keep=50):
+        self.gameserver = gameserver
+        self.sample_rate = sample_rate  # Fraction of requests traced
+        self.profile_rate = profile_rate  # Fraction of requests run under cProfile
+        self.slow_seconds = slow_ms / 1000
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.totals = {stage: [0, 0.0, 0.0] for stage in STAGES + ('total',)}  # {stage: [count, sum, max]}
+        self.slow = deque(maxlen=keep)  # Recent traces that worked for longer than slow_ms
+        self.profile_stats = None  # pstats.Stats merged from every profiled request
+        self.profiled = 0
+        self.profiling = threading.Lock()  # Held while a request runs under cProfile
+        self.stage_seconds = gameserver.metrics.histogram(
+            'game_stage_duration_seconds', 'Time per request stage, traced requests only', ('stage',))
+        self.patched = []  # [(owner, name, original)]
+        self.dump_requested = threading.Event()
+        threading.Thread(target=self.dump_loop, daemon=True).start()
+
+    def begin(self, target, read_seconds, parse_seconds):
+        """Trace for a freshly parsed request, or None if it is not sampled"""
+        trace = None
+        if self.sample_rate >= 1.0 or random.random() < self.sample_rate:
+            trace = RequestTrace(target, read_seconds, parse_seconds)
+        self.local.trace = trace
+        return trace
+
+    def activate(self, trace):
+        # asyncio mode: other requests ran while this one was parked, point the wrappers back at it
+        self.local.trace = trace
+
+    def finish(self, traces, send_seconds):
+        """Record the traces of one batch of responses, the send counts towards the last of them"""
+        self.local.trace = None
+        now = time.perf_counter()
+        traces[-1].add('send', send_seconds)
+        with self.lock:
+            for trace in traces:
+                total = now - trace.started
+                trace.spans['other'] = max(0.0, total - sum(trace.spans.values()))
+                for stage, seconds in list(trace.spans.items()) + [('total', total)]:
+                    entry = self.totals[stage]
+                    entry[0] += 1
+                    entry[1] += seconds
+                    entry[2] = max(entry[2], seconds)
+                # Long-polls are slow on purpose, only time spent working makes a request slow
+                busy = total - trace.spans.get('wait', 0.0)
+                if busy >= self.slow_seconds:
+                    self.slow.append((trace.target, busy, dict(trace.spans)))
+        for trace in traces:
+            for stage, seconds in trace.spans.items():
+                self.stage_seconds.observe(seconds, stage)
+
+    def timed(self, stage, function):
+        local = self.local
+
+        def wrapper(*args, **kwargs):
+            trace = getattr(local, 'trace', None)
+            if trace is None or trace.depth:
+                return function(*args, **kwargs)
+            trace.depth += 1
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                trace.depth -= 1
+                trace.add(stage, time.perf_counter() - started)
+        return wrapper
+
+    def profiled_dispatch(self, dispatch):
+        def wrapper(request, keep_alive=False):
+            # One profiler per process at a time (enforced from Python 3.12), a request
+            # that comes up while another is profiled simply isn't sampled
+            if random.random() >= self.profile_rate or not self.profiling.acquire(blocking=False):
+                return dispatch(request, keep_alive)
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(dispatch, request, keep_alive)
+            finally:
+                self.profiling.release()
+                self.merge_profile(profile)
+        return wrapper
+
+    def merge_profile(self, profile):
+        profile.create_stats()
+        if not profile.stats:
+            return  # Nothing was recorded, pstats refuses empty profiles
+        with self.lock:
+            if self.profile_stats is None:
+                self.profile_stats = pstats.Stats(profile)
+            else:
+                self.profile_stats.add(profile)
+            self.profiled += 1
+
+    def patch(self, owner, name, replacement):
+        self.patched.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, replacement)
+
+    def install(self):
+        gameserver = self.gameserver
+        self.patch(GameRoom, 'execute', self.timed('game', GameRoom.execute))
+        self.patch(GameRoom, 'wait_for_change', self.timed('wait', GameRoom.wait_for_change))
+        self.patch(GameRoom, 'encoded_state', self.timed('encode', GameRoom.encoded_state))
+        self.patch(Matchmaker, 'wait', self.timed('wait', Matchmaker.wait))
+        for name in ('json_response', 'json_body_response', 'response'):
+            self.patch(gameserver, name, self.timed('encode', getattr(gameserver, name)))
+        if self.profile_rate:
+            self.patch(gameserver, 'dispatch', self.profiled_dispatch(gameserver.dispatch))
+
+    def uninstall(self):
+        while self.patched:
+            owner, name, original = self.patched.pop()
+            if original is None:
+                delattr(owner, name)  # An instance attribute shadowing the class method
+            else:
+                setattr(owner, name, original)
+
+    def report(self, limit=30, reset=False):
+        """Stage table, slow requests and the merged profile as plain text"""
+        out = io.StringIO()
+        with self.lock:
+            out.write('{:<8} {:>10} {:>10} {:>10}\n'.format('stage', 'count', 'mean_us', 'max_us'))
+            for stage, (count, total, longest) in self.totals.items():
+                if count:
+                    out.write('{:<8} {:>10} {:>10.1f} {:>10.1f}\n'.format(
+                        stage, count, total / count * 1e6, longest * 1e6))
+            out.write('\nslowest recent requests (>= {:.0f}ms not counting waits)\n'.format(self.slow_seconds * 1000))
+            for target, busy, spans in sorted(self.slow, key=lambda entry: -entry[1])[:10]:
+                stages = ' '.join('{}={:.1f}'.format(stage, seconds * 1000) for stage, seconds in spans.items() if seconds)
+                out.write('{:>8.1f}ms {} {}\n'.format(busy * 1000, target, stages))
+            if self.profile_stats is not None:
+                out.write('\ncProfile of {} sampled requests\n'.format(self.profiled))
+                self.profile_stats.stream = out
+                self.profile_stats.sort_stats('cumulative').print_stats(limit)
+            if reset:
+                self.totals = {stage: [0, 0.0, 0.0] for stage in self.totals}
+                self.slow.clear()
+                self.profile_stats = None
+                self.profiled = 0
+        return out.getvalue()
+
+    def dump(self, *_):
+        # SIGUSR1 handler. It runs on the main thread, which may be holding self.lock right
+        # now (the asyncio loop finishing a trace), so the report is left to dump_loop()
+        self.dump_requested.set()
+
+    def dump_loop(self):
+        while True:
+            self.dump_requested.wait()
+            self.dump_requested.clear()
+            sys.stderr.write(self.report())
+            sys.stderr.flush()